@@ -0,0 +1,140 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+# Workers never open a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import benchmark
+import game
+import inputlog
+
+
+def make_job(path, args):
+    # A job from the command line: an input log replays as recorded, any
+    # other file is a level run for --ticks ticks of the benchmark script
+    if inputlog.is_log(path):
+        return {"inputs": path, "check": args.check}
+    return {"map": path, "ticks": args.ticks, "backend": args.backend, "sleep_margin": args.sleep_margin}
+
+
+def run_job(job):
+    # One headless run, summed up as a dict of JSON values
+    start = time.perf_counter()
+    result = {}
+    if "inputs" in job:
+        # The replay loads its own Model, so its ticks/s includes the load
+        sim, diverged = game.replay(job["inputs"], job.get("check", False))
+        if job.get("check"):
+            result["diverged_at"] = diverged
+        ticking = start
+    else:
+        sim = game.Simulation(job["map"], benchmark.play_script(job.get("ticks", 300)), job.get("backend", "objects"))
+        sim.model.sleep_margin = job.get("sleep_margin")
+        result["initial_entities"] = sim.model.entity_count()
+        ticking = time.perf_counter()
+        sim.run(job.get("ticks", 300))
+    end = time.perf_counter()
+    model = sim.model
+    result.update({
+        "ticks": sim.ticks,
+        "luigi_x": model.luigi.x,
+        "luigi_y": model.luigi.y,
+        "entities": model.entity_count(),
+        "removed": model.removed,
+        "state_hash": model.state_hash(),
+        "seconds": end - start,
+        "ticks_per_s": sim.ticks / (end - ticking),
+    })
+    return result
+
+
+def worker(index, job, results):
+    try:
+        result = run_job(job)
+    except BaseException as error:  # SystemExit too, or the run never reports
+        result = {"error": "%s: %s" % (type(error).__name__, error)}
+    results.put((index, result))
+
+
+def run(jobs, workers, timeout=None):
+    # Yields (index, result) as runs finish. Each run gets its own process,
+    # so one that dies or hangs becomes an error result instead of taking
+    # the rest of the batch with it.
+    results = multiprocessing.Queue()
+    pending = list(enumerate(jobs))[::-1]
+    running = {}  # index -> (process, start time)
+    exited = set()  # indexes whose process ended without a result yet
+    while pending or running:
+        while pending and len(running) < workers:
+            index, job = pending.pop()
+            process = multiprocessing.Process(target=worker, args=(index, job, results), daemon=True)
+            process.start()
+            running[index] = (process, time.perf_counter())
+        try:
+            index, result = results.get(timeout=0.2)
+        except queue.Empty:
+            pass
+        else:
+            if index in running:
+                running.pop(index)[0].join()
+                yield index, result
+            continue
+        # Nothing came back: look for workers that died or ran too long. A
+        # result put just before the process ended can still be on its way,
+        # so an ended worker gets one more round to deliver it.
+        for index, (process, started) in list(running.items()):
+            if process.exitcode is not None:
+                if index not in exited:
+                    exited.add(index)
+                    continue
+                del running[index]
+                if process.exitcode:
+                    yield index, {"error": "worker exited with code %d" % process.exitcode}
+                else:
+                    yield index, {"error": "worker exited without a result"}
+            elif timeout is not None and time.perf_counter() - started > timeout:
+                process.kill()
+                process.join()
+                del running[index]
+                yield index, {"error": "timed out after %gs" % timeout}
+
+
+def load_jobs(path):
+    # One JSON job per line: {"map": ..., "ticks": ..., "backend": ...,
+    # "sleep_margin": ...} or {"inputs": LOG, "check": ...}
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many headless simulations in parallel, one JSON line per run.")
+    parser.add_argument("paths", nargs="*", help="level files to run and input logs to replay")
+    parser.add_argument("--jobs", metavar="FILE", help="JSON lines file of jobs to run as well")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes at once (default: CPU count)")
+    parser.add_argument("--ticks", type=int, default=300, help="ticks per level run")
+    parser.add_argument("--backend", default="objects", help="entity backend for level runs")
+    parser.add_argument("--sleep-margin", type=int, default=None, help="see benchmark.py --sleep-margin")
+    parser.add_argument("--check", action="store_true", help="check replays' state hashes against the recording")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds before a run is killed")
+    parser.add_argument("--output", help="write the JSON lines here instead of stdout")
+    args = parser.parse_args()
+
+    jobs = [make_job(path, args) for path in args.paths]
+    if args.jobs:
+        jobs += load_jobs(args.jobs)
+    out = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    failed = 0
+    for index, result in run(jobs, max(1, args.workers), args.timeout):
+        failed += "error" in result or result.get("diverged_at") is not None
+        out.write(json.dumps(dict(job=index, spec=jobs[index], **result)) + "\n")
+        out.flush()
+    if out is not sys.stdout:
+        out.close()
+    print("%d runs, %d failed, %.2fs" % (len(jobs), failed, time.perf_counter() - start), file=sys.stderr)
+    sys.exit(1 if failed else 0)
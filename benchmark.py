@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+# The renderer benchmark draws into an offscreen surface
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import game
+import levels
+
+
+def generate_level(bricks, goombas, drybones, mushrooms=0, seed=0):
+    # A synthetic level in the map.json schema: a solid floor at y=450 with
+    # the rest of the bricks scattered over three platform rows above it
+    rng = random.Random(seed)
+    columns = max(40, bricks // 2)
+    level = {"bricks": [], "mushrooms": [], "goombas": [], "drybones": [], "fireballs": []}
+    for i in range(min(bricks, columns)):
+        level["bricks"].append({"x": i * 50, "y": 450, "w": 50, "h": 50})
+    taken = set()
+    while len(level["bricks"]) < bricks:
+        cell = (rng.randrange(columns), rng.choice((250, 300, 350)))
+        if cell in taken:
+            continue
+        taken.add(cell)
+        level["bricks"].append({"x": cell[0] * 50, "y": cell[1], "w": 50, "h": 50})
+    width = columns * 50
+    for _ in range(goombas):
+        level["goombas"].append({"x": rng.randrange(width), "y": 375, "w": 25, "h": 25,
+                                 "fireCounter": 0, "type": "goomba"})
+    for _ in range(drybones):
+        level["drybones"].append({"x": rng.randrange(width), "y": 350, "w": 40, "h": 50,
+                                  "type": "drybones"})
+    for _ in range(mushrooms):
+        level["mushrooms"].append({"x": rng.randrange(width), "y": 200, "w": 20, "h": 20,
+                                   "type": "mushroom"})
+    return level
+
+
+def play_script(ticks):
+    # Run right, jumping now and then and throwing a fireball every second
+    for t in range(ticks):
+        keys = {"right"}
+        if t % 25 == 0:
+            keys.add("up")
+        if t % 30 == 0:
+            keys.add("fire")
+        yield keys
+
+
+def bench_ticks(map_file, ticks, backend, sleep_margin=None):
+    start = time.perf_counter()
+    sim = game.Simulation(map_file, play_script(ticks), backend)
+    load = time.perf_counter() - start
+    sim.model.sleep_margin = sleep_margin
+    pairs = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sim.tick()
+        pairs += sim.model.pairs_tested
+    elapsed = time.perf_counter() - start
+    return {
+        "load_s": load,
+        "ticks": ticks,
+        "ticks_per_s": ticks / elapsed,
+        "pairs_per_tick": pairs / ticks,
+    }
+
+
+def bench_render(map_file, frames, static_layer, backend):
+    model = game.Model(map_file, backend)
+    view = game.View(model, static_layer)
+    view.set_edit_info(False, True, False, "brick")
+    # Scroll across the level like a player running right would
+    start = time.perf_counter()
+    for i in range(frames):
+        view.set_scroll_x(i * 5.5)
+        model.update()
+        view.update()
+    elapsed = time.perf_counter() - start
+    return frames / elapsed
+
+
+def bench_load(entities, backends, repeat=3):
+    # Same level as map.json and as a binary level: time the raw parse and
+    # the whole Model load for each
+    bricks = entities * 8 // 10
+    level = generate_level(bricks, (entities - bricks) // 2, (entities - bricks) - (entities - bricks) // 2)
+    result = {"entities": entities}
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {"json": os.path.join(tmp, "map.json"), "binary": os.path.join(tmp, "map.bin")}
+        with open(files["json"], "w") as file:
+            json.dump(level, file)
+        levels.write_binary(level, files["binary"])
+        for name, path in files.items():
+            result[name + "_bytes"] = os.path.getsize(path)
+            parse = levels.read_binary if name == "binary" else load_json
+            result[name + "_parse_s"] = best_time(lambda: parse(path), repeat)
+            for backend in backends:
+                result["%s_model_%s_s" % (name, backend)] = best_time(lambda: game.Model(path, backend), repeat)
+            if "objects" in backends:
+                # What the game waits for before its first frame
+                result[name + "_model_lazy_s"] = best_time(lambda: game.Model(path, "objects", lazy=True), repeat)
+    print("%d entities: parse %.3fs json, %.4fs binary" % (
+        entities, result["json_parse_s"], result["binary_parse_s"]))
+    for backend in backends:
+        print("  Model(%s): %.3fs json, %.3fs binary" % (
+            backend, result["json_model_%s_s" % backend], result["binary_model_%s_s" % backend]))
+    if "objects" in backends:
+        print("  Model(objects, lazy): %.3fs json, %.3fs binary" % (
+            result["json_model_lazy_s"], result["binary_model_lazy_s"]))
+    return result
+
+
+def bench_memory(entities):
+    # Bytes per entity as seen by tracemalloc, building `entities` sprites of
+    # each class (and batch rows, with numpy); shared images are loaded first
+    # so only the per-entity cost is counted
+    kinds = [("brick", game.Brick, "images/brick.png"), ("mushroom", game.Mushroom, "images/mushroom.png"),
+             ("goomba", game.Goomba, "images/goomba.png"), ("drybones", game.DryBones, "images/drybones1.png"),
+             ("fireball", game.Fireball, "images/fireball.png"), ("luigi", game.Luigi, "images/luigi1.png")]
+    batches = {}
+    if game.np is not None:
+        batches = {"mushroom": game.MushroomBatch, "goomba": game.GoombaBatch, "drybones": game.DryBonesBatch,
+                   "fireball": game.FireballBatch}
+    result = {"entities": entities}
+    for name, cls, image in kinds:
+        cls(0, 0, 25, 25, image)
+        tracemalloc.start()
+        sprites = [cls(i, 0, 25, 25, image) for i in range(entities)]
+        result[name + "_bytes"] = tracemalloc.get_traced_memory()[0] / entities
+        tracemalloc.stop()
+        del sprites
+        line = "%-8s %6.0f bytes/entity" % (name, result[name + "_bytes"])
+        if name in batches:
+            batch = batches[name]()
+            column = list(range(entities))
+            batch.extend(column, column, [25] * entities, [25] * entities)
+            result[name + "_batch_bytes"] = sum(getattr(batch, c).nbytes for c in batch.columns()) / entities
+            line += ", %4.0f in a batch" % result[name + "_batch_bytes"]
+        print(line)
+    return result
+
+
+def bench_replay(path, repeat=3):
+    # A recorded session (see game.py --record) as a fixed workload
+    result = {"log": os.path.basename(path)}
+    ticks = []
+    result["replay_s"] = best_time(lambda: ticks.append(game.replay(path)[0].ticks), repeat)
+    result["ticks"] = ticks[0]
+    result["ticks_per_s"] = ticks[0] / result["replay_s"]
+    print("%s: %d ticks, %.1f ticks/s" % (result["log"], result["ticks"], result["ticks_per_s"]))
+    return result
+
+
+def load_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(brick_counts, enemy_counts, ticks, frames, backends, sleep_margin=None):
+    results = []
+    pygame.display.init()
+    pygame.display.set_mode((1000, 500))
+    with tempfile.TemporaryDirectory() as tmp:
+        for bricks in brick_counts:
+            for enemies in enemy_counts:
+                map_file = os.path.join(tmp, "map_%d_%d.json" % (bricks, enemies))
+                with open(map_file, "w") as file:
+                    json.dump(generate_level(bricks, enemies // 2, enemies - enemies // 2), file)
+                for backend in backends:
+                    result = {"bricks": bricks, "enemies": enemies, "backend": backend}
+                    result.update(bench_ticks(map_file, ticks, backend, sleep_margin))
+                    result["frames_per_s"] = bench_render(map_file, frames, True, backend)
+                    result["frames_per_s_immediate"] = bench_render(map_file, frames, False, backend)
+                    print("%7d bricks %5d enemies %-7s: %8.1f ticks/s %8.1f pairs/tick %7.1f fps" % (
+                        bricks, enemies, backend, result["ticks_per_s"], result["pairs_per_tick"],
+                        result["frames_per_s"]))
+                    results.append(result)
+    return results
+
+
+def counts(text):
+    return [int(n) for n in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time Model.update and View.update on synthetic levels.")
+    parser.add_argument("--bricks", type=counts, default=[1000, 10000, 100000],
+                        help="comma separated brick counts (default 1000,10000,100000)")
+    parser.add_argument("--enemies", type=counts, default=[10, 100, 1000],
+                        help="comma separated Goomba + DryBones counts (default 10,100,1000)")
+    parser.add_argument("--backends", type=lambda text: text.split(","),
+                        default=["objects", "numpy"] if game.np is not None else ["objects"],
+                        help="comma separated entity backends (default objects and, if installed, numpy)")
+    parser.add_argument("--sleep-margin", type=int, default=None,
+                        help="let enemies this many px outside the window sleep (default: all stay awake)")
+    parser.add_argument("--ticks", type=int, default=300, help="Model.update ticks per level")
+    parser.add_argument("--frames", type=int, default=100, help="View.update frames per level")
+    parser.add_argument("--load-entities", type=int, default=100000,
+                        help="entities in the JSON vs binary load comparison, 0 to skip")
+    parser.add_argument("--memory-entities", type=int, default=10000,
+                        help="entities per class in the memory comparison, 0 to skip")
+    parser.add_argument("--replays", type=lambda text: text.split(","), default=[],
+                        help="comma separated input logs to replay as extra workloads")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    results = run(args.bricks, args.enemies, args.ticks, args.frames, args.backends, args.sleep_margin)
+    load = bench_load(args.load_entities, args.backends) if args.load_entities else None
+    memory = bench_memory(args.memory_entities) if args.memory_entities else None
+    replays = [bench_replay(path) for path in args.replays]
+    with open(args.output, "w") as file:
+        json.dump({
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "ticks": args.ticks,
+            "frames": args.frames,
+            "sleep_margin": args.sleep_margin,
+            "results": results,
+            "load": load,
+            "memory": memory,
+            "replays": replays,
+        }, file, indent=2)
+    print("Wrote", args.output)
@@ -1,18 +1,341 @@
+import argparse
 import pygame
 import time
 import json
+import math
+import csv
+import logging
+import os
+import shutil
+import struct
+import zlib
+
+from collections import Counter, OrderedDict, deque
 
 from pygame.locals import *
 from time import sleep
 
+import inputlog
+import levels
+
+try:
+    import numpy as np
+except ImportError:  # only the numpy entity backend needs it
+    np = None
+
+log = logging.getLogger("game")
+# Checked before logging on hot paths so disabled debug output costs only
+# a global lookup; kept in sync by set_log_level
+debug_logging = False
+
+def set_log_level(level):
+    global debug_logging
+    if not log.handlers:
+        logging.basicConfig(format="%(levelname)s %(message)s")
+    log.setLevel(level)
+    debug_logging = log.isEnabledFor(logging.DEBUG)
+
+class Profiler:
+    # Per-frame phase timings (in seconds) and counters for the last
+    # `history` frames. Every call is a no-op until enabled is set.
+    PHASES = ("events", "controller", "entities", "collision", "removal", "draw", "flip")
+    COUNTERS = ("ticks", "pairs_tested", "collisions", "drawn", "culled", "surfaces")
+
+    def __init__(self, history=300):
+        self.enabled = False
+        self.keep = False  # stay enabled without the overlay, for --profile
+        self.frames = deque(maxlen=history)
+        self.frame = None
+        self.frame_number = 0
+        self.start = 0
+        self.last = 0
+
+    def begin(self):
+        if not self.enabled:
+            return
+        self.frame = dict.fromkeys(self.PHASES, 0.0)
+        self.frame.update(dict.fromkeys(self.COUNTERS, 0))
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        # Charge the time since the previous mark to `phase`
+        if self.frame is None:
+            return
+        now = time.perf_counter()
+        self.frame[phase] += now - self.last
+        self.last = now
+
+    def count(self, name, n=1):
+        if self.frame is not None:
+            self.frame[name] += n
+
+    def end(self):
+        if self.frame is None:
+            return
+        self.frame["frame"] = self.frame_number
+        self.frame["total"] = time.perf_counter() - self.start
+        self.frames.append(self.frame)
+        self.frame = None
+        self.frame_number += 1
+
+    def average(self, frames=30):
+        recent = list(self.frames)[-frames:]
+        if not recent:
+            return {}
+        return {k: sum(f[k] for f in recent) / len(recent)
+                for k in self.PHASES + self.COUNTERS + ("total",)}
+
+    def export(self, path):
+        # CSV when the file name says so, JSON otherwise
+        fields = ("frame", "total") + self.PHASES + self.COUNTERS
+        with open(path, "w", newline="") as file:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(file, fields)
+                writer.writeheader()
+                writer.writerows(self.frames)
+            else:
+                json.dump([{k: f[k] for k in fields} for f in self.frames], file, indent=1)
+
+profiler = Profiler()
+
+class StartupProfile:
+    # Wall time of each step from main() starting to the first frame
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.steps = []
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = ["Startup:"]
+        lines += ["  %-12s %7.1f ms" % (step, seconds * 1000) for step, seconds in self.steps]
+        lines.append("  %-12s %7.1f ms" % ("total", (self.last - self.start) * 1000))
+        return "\n".join(lines)
+
+# The physics runs at this fixed rate whatever the frame rate; every speed
+# and acceleration in the game is per tick of it
+TICKS_PER_SECOND = 30
+# Ticks run in one frame at most before the simulation is let fall behind
+# real time, so a stall cannot snowball into ever longer frames
+MAX_FRAME_TICKS = 5
+# Seconds of each frame the game loop spends loading the rest of a level
+LOAD_BUDGET = 0.002
+
+class TextureAtlas:
+    # Packs images into one sheet on shelves: each image goes right of the
+    # last one on the current shelf, and a new shelf starts under the
+    # tallest image so far once the row is full. Pixels are copied unblended
+    # so the sheet holds the images exactly, alpha included.
+    def __init__(self, width, height):
+        self.sheet = pygame.Surface((width, height), SRCALPHA)
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            self.sheet = self.sheet.convert_alpha()
+        self.rects = {}
+        self.x = 0
+        self.shelf_y = 0
+        self.shelf_h = 0
+
+    def add(self, key, surface):
+        # The image's rect on the sheet, or None when it no longer fits
+        w, h = surface.get_size()
+        if self.x + w > self.sheet.get_width():
+            self.x = 0
+            self.shelf_y += self.shelf_h
+            self.shelf_h = 0
+        if w > self.sheet.get_width() or self.shelf_y + h > self.sheet.get_height():
+            return None
+        rect = pygame.Rect(self.x, self.shelf_y, w, h)
+        self.sheet.blit(surface, rect, special_flags=BLEND_RGBA_MAX)
+        self.rects[key] = rect
+        self.x += w
+        self.shelf_h = max(self.shelf_h, h)
+        return rect
+
+    def used_height(self):
+        return self.shelf_y + self.shelf_h
+
+class AssetCache:
+    # Loads every image file once and hands the same surface to every sprite
+    # that asks for it.
+    def __init__(self):
+        self.surfaces = {}
+        self.hits = 0
+        self.misses = 0
+        self.atlas_images = 0
+
+    def load(self, path):
+        surface = self.surfaces.get(path)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+        profiler.count("surfaces")
+        surface = pygame.image.load(path)
+        # Converting needs a display; headless runs keep the file's format
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            if surface.get_flags() & SRCALPHA:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+        self.surfaces[path] = surface
+        return surface
+
+    def load_atlas(self, directory="images", width=512):
+        # Serve every PNG in the directory from one sheet, so startup opens
+        # one image file instead of one per frame. The packed sheet is kept
+        # as raw RGBA in atlas.rgba, which loads without decoding, next to
+        # atlas.json with its size and rect table; both are rebuilt whenever
+        # a PNG is newer than them.
+        sheet_path = directory + "/atlas.rgba"
+        table_path = directory + "/atlas.json"
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".png"))
+        table = None
+        if os.path.exists(table_path) and os.path.exists(sheet_path):
+            built = os.path.getmtime(table_path)
+            with open(table_path) as file:
+                table = json.load(file)
+            if sorted(table["rects"]) != names or any(os.path.getmtime(directory + "/" + n) > built for n in names):
+                table = None
+        if table is None:
+            images = {n: pygame.image.load(directory + "/" + n) for n in names}
+            atlas = TextureAtlas(width, sum(image.get_height() for image in images.values()))
+            # Tallest first keeps the shelves evenly filled
+            for name in sorted(names, key=lambda n: -images[n].get_height()):
+                if atlas.add(name, images[name]) is None:
+                    raise ValueError("%s is wider than the %d px atlas" % (name, width))
+            sheet = atlas.sheet.subsurface((0, 0, width, max(1, atlas.used_height()))).copy()
+            table = {"size": sheet.get_size(), "rects": {n: list(r) for n, r in atlas.rects.items()}}
+            try:
+                with open(sheet_path, "wb") as file:
+                    file.write(pygame.image.tostring(sheet, "RGBA"))
+                with open(table_path, "w") as file:
+                    json.dump(table, file)
+            except OSError:
+                pass  # a read-only checkout just rebuilds it next time
+        else:
+            with open(sheet_path, "rb") as file:
+                sheet = pygame.image.fromstring(file.read(), tuple(table["size"]), "RGBA")
+        self.misses += 1
+        profiler.count("surfaces")
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            sheet = sheet.convert_alpha()
+        for name, rect in table["rects"].items():
+            self.surfaces[directory + "/" + name] = sheet.subsurface(rect)
+        self.atlas_images += len(table["rects"])
+
+    def memory(self):
+        # Atlas images share their sheet's pixels, so count the sheet once
+        surfaces = {s.get_parent() or s for s in self.surfaces.values()}
+        return sum(s.get_pitch() * s.get_height() for s in surfaces)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+        self.atlas_images = 0
+
+    def report(self):
+        atlas = ", %d of them from the atlas" % self.atlas_images if self.atlas_images else ""
+        return "%d images loaded%s, %d cache hits, %.1f KB" % (
+            len(self.surfaces), atlas, self.hits, self.memory() / 1024)
+
+assets = AssetCache()
+
+class TransformCache:
+    # Scaled (and optionally mirrored) copies of source surfaces, packed into
+    # TextureAtlas sheets so sprites draw as area blits. The key holds the
+    # target size, so a sprite changing size (Luigi eating a mushroom)
+    # simply looks up a different entry. New images go on the newest sheet;
+    # when it is full a fresh one starts, and past max_sheets the least
+    # recently used sheet is evicted with all its entries, so the working
+    # set stays cached while the memory stays bounded.
+    def __init__(self, sheet_size=1024, max_sheets=4):
+        self.sheet_size = sheet_size
+        self.max_sheets = max_sheets
+        self.entries = {}  # key -> (sheet, area, atlas)
+        self.sheets = OrderedDict()  # atlases, least recently used first
+        self.atlas = None  # the sheet new images are packed into
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def region(self, surface, w, h, flip=False):
+        # The (sheet, area) to blit for the surface scaled to w x h
+        key = (surface, int(w), int(h), flip)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            sheet, area, atlas = entry
+            self.sheets.move_to_end(atlas)
+            return sheet, area
+        self.misses += 1
+        profiler.count("surfaces")
+        image = pygame.transform.scale(surface, (int(w), int(h)))
+        if flip:
+            image = pygame.transform.flip(image, True, False)
+        rect = self.atlas.add(key, image) if self.atlas is not None else None
+        if rect is None:
+            if len(self.sheets) >= self.max_sheets:
+                old, _ = self.sheets.popitem(last=False)
+                for old_key in old.rects:
+                    del self.entries[old_key]
+                self.evictions += len(old.rects)
+            # Anything bigger than a sheet gets a sheet of its own size
+            self.atlas = TextureAtlas(max(self.sheet_size, int(w)), max(self.sheet_size, int(h)))
+            self.sheets[self.atlas] = None
+            rect = self.atlas.add(key, image)
+        self.sheets.move_to_end(self.atlas)
+        self.entries[key] = (self.atlas.sheet, rect, self.atlas)
+        return self.atlas.sheet, rect
+
+    def clear(self):
+        self.entries.clear()
+        self.sheets.clear()
+        self.atlas = None
+
+transforms = TransformCache()
+
+class Animation:
+    # A frame table shared by every sprite of a class: the image files, how
+    # many ticks each frame shows for and how many of the leading frames make
+    # up the looping cycle. Frames load on first use, since sprite classes are
+    # defined before there is a display to convert them for.
+    __slots__ = ("paths", "ticks", "cycle", "frames")
+
+    def __init__(self, paths, ticks=1, cycle=None):
+        self.paths = tuple(paths)
+        self.ticks = ticks
+        self.cycle = len(self.paths) if cycle is None else cycle
+        self.frames = None
+
+    def __getitem__(self, i):
+        if self.frames is None:
+            self.frames = [assets.load(path) for path in self.paths]
+        return self.frames[i]
+
+    def __len__(self):
+        return len(self.paths)
+
+# Collision tags, one per sprite class
+TAG_BRICK, TAG_LUIGI, TAG_MUSHROOM, TAG_GOOMBA, TAG_DRY_BONES, TAG_FIREBALL = range(6)
+SLEEPERS = {TAG_MUSHROOM, TAG_GOOMBA, TAG_DRY_BONES}  # tags Model.sleep_margin applies to
+
 class Sprite:
+    # Slotted all the way down: a level holds tens of thousands of these
+    tag = None
+    __slots__ = ("x", "y", "w", "h", "speed", "image", "order", "spawn_id")
+
     def __init__(self, x, y, w, h, image):
         self.x = x
         self.y = y
         self.w = w
         self.h = h
         self.speed = 1
-        self.image = pygame.image.load(image)
+        self.image = assets.load(image)
+        self.spawn_id = None
         
     def collides_with(self, other):
         return not(self.x + self.w <= other.x or
@@ -20,48 +343,33 @@ class Sprite:
                   self.y + self.h <= other.y or
                   self.y >= other.y + other.h)
 
-    def draw(self, g, scroll_pos_x):
-        # Scale the current image to (w, h)
-        image = pygame.transform.scale(self.image, (self.w, self.h))
-        # Draw it at the correct position, adjusted by scroll
-        g.blit(image, (self.x - scroll_pos_x, self.y))
+    def blit_args(self, scroll_pos_x):
+        # (source, dest, area) of the current image scaled to (w, h), placed
+        # at the sprite's position adjusted by scroll; see Surface.blits
+        sheet, area = transforms.region(self.image, self.w, self.h)
+        return sheet, (self.x - scroll_pos_x, self.y), area
 
-    def is_brick(self):
-        return False
-        
-    def is_luigi(self):
-        return False
-        
-    def is_mushroom(self):
-        return False
-        
-    def is_goomba(self):
-        return False
-        
-    def is_dry_bones(self):
-        return False
-        
-    def is_fireball(self):
-        return False
+    def draw(self, g, scroll_pos_x):
+        g.blit(*self.blit_args(scroll_pos_x))
 
 class Brick(Sprite):
+    tag = TAG_BRICK
+    __slots__ = ()
+
     def __init__(self, x, y, w, h, image):
         super().__init__(x, y, w, h, image)
         
-    def is_brick(self):
-        return True
-        
     def update(self):
         pass
 
 class Mushroom(Sprite):
+    tag = TAG_MUSHROOM
+    __slots__ = ("vert_velocity",)
+
     def __init__(self, x, y, w, h, img_url):
         super().__init__(x, y, w, h, img_url)
         self.vert_velocity = 2.2
         
-    def is_mushroom(self):
-        return True
-        
     def update(self):
         self.y += self.vert_velocity
         if self.y > 500:
@@ -74,6 +382,11 @@ class Mushroom(Sprite):
             self.vert_velocity = 0
 
 class Goomba(Sprite):
+    tag = TAG_GOOMBA
+    __slots__ = ("vert_velocity", "velocity_x", "on_fire", "fire_counter",
+                 "collided", "collided2", "collision_direction")
+    FIRE = Animation(["images/goomba_fire.png"])
+
     def __init__(self, x, y, w, h, img_url):
         super().__init__(x, y, w, h, img_url)
         self.vert_velocity = 0
@@ -83,11 +396,6 @@ class Goomba(Sprite):
         self.collided = False
         self.collided2 = False
         self.collision_direction = None # left or right collision
-        self.normal_image = pygame.image.load(img_url)  # Store the normal image
-        self.fire_image = pygame.image.load("images/goomba_fire.png")  # Load fire image
-        
-    def is_goomba(self):
-        return True
         
     def set_collided(self, c):
         self.collided = c
@@ -141,7 +449,7 @@ class Goomba(Sprite):
             self.on_fire = True
             self.fire_counter = 60
             self.velocity_x = 0 
-            self.image = self.fire_image  # Change to fire image
+            self.image = self.FIRE[0]  # Change to fire image
 
     def disappear(self):
         if self.fire_counter == 1:
@@ -149,6 +457,14 @@ class Goomba(Sprite):
         return False
 
 class DryBones(Sprite):
+    tag = TAG_DRY_BONES
+    __slots__ = ("vert_velocity", "velocity_x", "collided", "collided2", "knock_out",
+                 "knock_out_counter", "frame_counter", "flip", "image_num")
+    # Walks through the first 8 frames, a new one every 3 ticks; frame 10
+    # is the knocked out pile of bones
+    FRAMES = Animation([f"images/drybones{i}.png" for i in range(1, 12)], ticks=3, cycle=8)
+    KNOCKED = 10
+
     def __init__(self, x, y, w, h, img_url):
         super().__init__(x, y, w, h, img_url)
         self.vert_velocity = 0
@@ -159,17 +475,8 @@ class DryBones(Sprite):
         self.knock_out_counter = 0
         self.frame_counter = 0
         self.flip = False
-        self.images = []
         self.image_num = 0
-        
-        # Create and load all images upfront
-        for i in range(1, 12):
-            img = pygame.image.load(f"images/drybones{i}.png")
-            self.images.append(img)
-        self.image = self.images[0]  # Set initial image
-        
-    def is_dry_bones(self):
-        return True
+        self.image = self.FRAMES[0]  # Set initial image
         
     def set_collided(self, c):
         self.collided = c
@@ -180,7 +487,7 @@ class DryBones(Sprite):
     def knocked(self):
         if not self.knock_out:
             self.knock_out = True
-            self.image = self.images[10]
+            self.image = self.FRAMES[self.KNOCKED]
             self.knock_out_counter = 180
             
     def update(self):
@@ -202,7 +509,7 @@ class DryBones(Sprite):
             if self.knock_out_counter == 0:
                 self.knock_out = False
                 self.image_num = 0
-                self.image = self.images[self.image_num]
+                self.image = self.FRAMES[self.image_num]
 
                 if not self.flip:
                     self.velocity_x = -1.5
@@ -211,11 +518,11 @@ class DryBones(Sprite):
                 self.x += self.velocity_x
         
         self.frame_counter += 1
-        if not self.knock_out and self.frame_counter % 3 == 0:
+        if not self.knock_out and self.frame_counter % self.FRAMES.ticks == 0:
             self.image_num += 1
-            if self.image_num >= 11-3:
+            if self.image_num >= self.FRAMES.cycle:
                 self.image_num = 0
-            self.image = self.images[self.image_num]  # Update current image
+            self.image = self.FRAMES[self.image_num]  # Update current image
 
     def collision(self, b):
         top_c = self.y + self.h >= b.y and self.y < b.y
@@ -234,24 +541,19 @@ class DryBones(Sprite):
                 self.x = b.x + b.w
                 self.set_collided2(True)
                 
-    def draw(self, g, scroll_pos_x):
-        if self.image:
-            scaled_image = pygame.transform.scale(self.image, (self.w, self.h))
-            if not self.flip:
-                g.blit(scaled_image, (self.x - scroll_pos_x, self.y))
-            else:
-                flipped_image = pygame.transform.flip(scaled_image, True, False)
-                g.blit(flipped_image, (self.x - scroll_pos_x, self.y))
+    def blit_args(self, scroll_pos_x):
+        sheet, area = transforms.region(self.image, self.w, self.h, self.flip)
+        return sheet, (self.x - scroll_pos_x, self.y), area
 
 class Fireball(Sprite):
+    tag = TAG_FIREBALL
+    __slots__ = ("vert_velocity", "velocity_x")
+
     def __init__(self, x, y, w, h, img_url):
         super().__init__(x, y, w, h, img_url)
         self.vert_velocity = 2.2
         self.velocity_x = 15
         
-    def is_fireball(self):
-        return True
-    
     # def collision(self, b):
     #     if self.y + self.h >= b.y and self.vert_velocity > 0:  # top side collision
     #         self.y = b.y - self.h
@@ -276,6 +578,12 @@ class Fireball(Sprite):
         self.vert_velocity += 2
 
 class Luigi(Sprite):
+    tag = TAG_LUIGI
+    __slots__ = ("vert_velocity", "velocity_x", "is_jumping", "is_moving", "eat_mush",
+                 "level_width", "frame_counter", "jump_counter", "image_num")
+    # Running cycles through all 5 frames, a new one every 6 ticks
+    FRAMES = Animation([f"images/luigi{i}.png" for i in range(1, 6)], ticks=6)
+
     def __init__(self, x, y, w, h, img_url):
         super().__init__(x, y, w, h, img_url)
         self.vert_velocity = 0
@@ -283,19 +591,11 @@ class Luigi(Sprite):
         self.is_jumping = False
         self.is_moving = False
         self.eat_mush = False
+        self.level_width = 2000
         self.frame_counter = 0
         self.jump_counter = 0
         self.image_num = 0
-        self.images = []
-        
-        # Create and load all images upfront
-        for i in range(1, 6):
-            img = pygame.image.load(f"images/luigi{i}.png")
-            self.images.append(img)
-        self.image = self.images[0]  # Set initial image
-        
-    def is_luigi(self):
-        return True
+        self.image = self.FRAMES[0]  # Set initial image
         
     def move_right(self):
         self.velocity_x = 5.5
@@ -309,7 +609,7 @@ class Luigi(Sprite):
         self.velocity_x = 0
         self.is_moving = False
         self.image_num = 0
-        self.image = self.images[self.image_num]
+        self.image = self.FRAMES[self.image_num]
         
     def jump(self):
         if not self.is_jumping:
@@ -320,7 +620,7 @@ class Luigi(Sprite):
         self.vert_velocity += 2.2
         self.y += self.vert_velocity
         self.x += self.velocity_x
-        self.x = max(0, min(self.x, 2000 - self.w))  # keep within bounds
+        self.x = max(0, min(self.x, self.level_width - self.w))  # keep within bounds
 
         if self.y + self.h < 500:
             self.jump_counter += 1
@@ -329,13 +629,13 @@ class Luigi(Sprite):
 
         if self.is_moving:
             self.frame_counter += 1
-            if self.frame_counter >= 6:
-                self.image_num = (self.image_num + 1) % 5  # Luigi has 5 images total
+            if self.frame_counter >= self.FRAMES.ticks:
+                self.image_num = (self.image_num + 1) % self.FRAMES.cycle
                 self.frame_counter = 0
-                self.image = self.images[self.image_num]
+                self.image = self.FRAMES[self.image_num]
         else:
             self.image_num = 0
-            self.image = self.images[self.image_num]
+            self.image = self.FRAMES[self.image_num]
         
         if self.y + self.h >= 500:
             self.y = 500 - self.h
@@ -351,15 +651,18 @@ class Luigi(Sprite):
         elif self.y <= b.y + b.h and self.y > b.y and self.vert_velocity < 0:  # bottom side collision 
             self.y = b.y + b.h
             self.vert_velocity = 0
-            print("Hit the bottom of the brick!")
+            if debug_logging:
+                log.debug("Hit the bottom of the brick!")
         elif self.x <= b.x + b.w and self.x + self.w > b.x + b.w:  # right side collision
             self.stop()
             self.x = b.x + b.w
-            print("Hit the right side of the brick!")
+            if debug_logging:
+                log.debug("Hit the right side of the brick!")
         elif self.x + self.w >= b.x and self.x < b.x:  # left side collision
             self.stop()
             self.x = b.x - self.w
-            print("Hit the left side of the brick!")
+            if debug_logging:
+                log.debug("Hit the left side of the brick!")
             
     def eat_mushroom(self):
         if not self.eat_mush:
@@ -371,120 +674,1546 @@ class Luigi(Sprite):
             self.h = 50
             self.eat_mush = False
 
-class Model:
+class SpatialHash:
+    # Uniform grid broadphase. Every sprite is stored in each cell its box
+    # touches, so sprites that can overlap always share at least one cell.
+    def __init__(self, cell_size=50):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.ranges = {}
+
+    def __contains__(self, sprite):
+        return sprite in self.ranges
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def cell_range(self, x, y, w, h):
+        c = self.cell_size
+        return (int(x // c), int(y // c), int((x + w) // c), int((y + h) // c))
+
+    def insert(self, sprite):
+        r = self.cell_range(sprite.x, sprite.y, sprite.w, sprite.h)
+        self.ranges[sprite] = r
+        self.add_to_cells(sprite, r)
+
+    def remove(self, sprite):
+        r = self.ranges.pop(sprite, None)
+        if r is not None:
+            self.remove_from_cells(sprite, r)
+
+    def move(self, sprite):
+        # Only touch the buckets when the sprite actually crossed a cell border
+        old = self.ranges.get(sprite)
+        if old is None:
+            return
+        r = self.cell_range(sprite.x, sprite.y, sprite.w, sprite.h)
+        if r != old:
+            self.remove_from_cells(sprite, old)
+            self.add_to_cells(sprite, r)
+            self.ranges[sprite] = r
+
+    def add_to_cells(self, sprite, r):
+        cells = self.cells
+        for cx in range(r[0], r[2] + 1):
+            for cy in range(r[1], r[3] + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    cells[(cx, cy)] = [sprite]
+                else:
+                    bucket.append(sprite)
+
+    def remove_from_cells(self, sprite, r):
+        cells = self.cells
+        for cx in range(r[0], r[2] + 1):
+            for cy in range(r[1], r[3] + 1):
+                bucket = cells[(cx, cy)]
+                bucket.remove(sprite)
+                if not bucket:
+                    del cells[(cx, cy)]
+
+    def query(self, x, y, w, h):
+        # Every sprite sharing a cell with the box (a superset of the overlaps)
+        found = set()
+        cells = self.cells
+        r = self.cell_range(x, y, w, h)
+        for cx in range(r[0], r[2] + 1):
+            for cy in range(r[1], r[3] + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return found
+
+class TileGrid:
+    # Immovable bricks in a dense 2D occupancy grid indexed by
+    # (x // tile_size, y // tile_size). Built when the level loads; the
+    # editor adds and removes single bricks in place.
+    def __init__(self, bricks, tile_size=50):
+        self.tile_size = tile_size
+        self.bricks = dict.fromkeys(bricks)  # ordered set, in load order
+        self.np_arrays = None
+        self.rows_of = None  # brick -> row of the arrays() boxes
+        if not self.bricks:
+            self.min_cx = self.min_cy = 0
+            self.cols = self.rows = 0
+            self.cells = []
+            return
+        ranges = [self.cell_range(b.x, b.y, b.w, b.h) for b in self.bricks]
+        self.min_cx = min(r[0] for r in ranges)
+        self.min_cy = min(r[1] for r in ranges)
+        self.cols = max(r[2] for r in ranges) - self.min_cx + 1
+        self.rows = max(r[3] for r in ranges) - self.min_cy + 1
+        self.cells = [None] * (self.cols * self.rows)
+        for brick, r in zip(self.bricks, ranges):
+            for cy in range(r[1], r[3] + 1):
+                for cx in range(r[0], r[2] + 1):
+                    i = (cy - self.min_cy) * self.cols + (cx - self.min_cx)
+                    if self.cells[i] is None:
+                        self.cells[i] = (brick,)
+                    else:
+                        self.cells[i] += (brick,)
+
+    def __len__(self):
+        return len(self.bricks)
+
+    def cell_indices(self, brick):
+        x0, y0, x1, y1 = self.cell_range(brick.x, brick.y, brick.w, brick.h)
+        for cy in range(y0, y1 + 1):
+            for cx in range(x0, x1 + 1):
+                yield (cy - self.min_cy) * self.cols + (cx - self.min_cx)
+
+    def add(self, brick):
+        # The brick must come later in load order than every brick here
+        x0, y0, x1, y1 = self.cell_range(brick.x, brick.y, brick.w, brick.h)
+        if (not self.cells or x0 < self.min_cx or y0 < self.min_cy
+                or x1 >= self.min_cx + self.cols or y1 >= self.min_cy + self.rows):
+            # Outside the grid: lay it out again with room for the brick
+            self.__init__(list(self.bricks) + [brick], self.tile_size)
+            return
+        self.bricks[brick] = None
+        for i in self.cell_indices(brick):
+            self.cells[i] = (self.cells[i] or ()) + (brick,)
+        if self.np_arrays is not None:
+            boxes, table = self.np_arrays
+            row = len(boxes)
+            self.rows_of[brick] = row
+            boxes = np.vstack((boxes, [(brick.x, brick.y, brick.w, brick.h)]))
+            for i in self.cell_indices(brick):
+                free = np.nonzero(table[i] < 0)[0]
+                if not free.size:
+                    table = np.pad(table, ((0, 0), (0, 1)), constant_values=-1)
+                    free = [table.shape[1] - 1]
+                table[i, free[0]] = row
+            self.np_arrays = (boxes, table)
+
+    def remove(self, brick):
+        del self.bricks[brick]
+        for i in self.cell_indices(brick):
+            cell = tuple(b for b in self.cells[i] if b is not brick)
+            self.cells[i] = cell or None
+        if self.np_arrays is not None:
+            # Its row stays, as a box nothing can overlap, so the rows of
+            # the other bricks keep their load order
+            boxes, table = self.np_arrays
+            row = self.rows_of.pop(brick)
+            boxes[row] = np.nan
+            for i in self.cell_indices(brick):
+                table[i][table[i] == row] = -1
+
+    def cell_range(self, x, y, w, h):
+        t = self.tile_size
+        # A brick ending exactly on a border does not reach into the next cell
+        return (int(x // t), int(y // t), int(-(-(x + w) // t)) - 1, int(-(-(y + h) // t)) - 1)
+
+    def overlapping(self, x, y, w, h):
+        # Solid tiles whose box overlaps (x, y, w, h), in load order
+        t = self.tile_size
+        cx0 = max(int(x // t), self.min_cx)
+        cy0 = max(int(y // t), self.min_cy)
+        cx1 = min(int((x + w) // t), self.min_cx + self.cols - 1)
+        cy1 = min(int((y + h) // t), self.min_cy + self.rows - 1)
+        found = []
+        seen = set()
+        cells = self.cells
+        for cy in range(cy0, cy1 + 1):
+            row = (cy - self.min_cy) * self.cols - self.min_cx
+            for cx in range(cx0, cx1 + 1):
+                cell = cells[row + cx]
+                if cell is None:
+                    continue
+                for b in cell:
+                    if (x + w > b.x and x < b.x + b.w and y + h > b.y and y < b.y + b.h
+                            and b not in seen):
+                        seen.add(b)
+                        found.append(b)
+        if len(found) > 1:
+            found.sort(key=lambda b: b.order)
+        return found
+
+    def arrays(self):
+        # Brick boxes (one row per brick, in load order) and a cell -> brick
+        # index table padded with -1, for the numpy backend
+        if self.np_arrays is None:
+            boxes = np.array([(b.x, b.y, b.w, b.h) for b in self.bricks], dtype=float).reshape(-1, 4)
+            self.rows_of = {b: i for i, b in enumerate(self.bricks)}
+            depth = max((len(cell) for cell in self.cells if cell), default=1)
+            table = np.full((len(self.cells), depth), -1, dtype=np.int64)
+            for i, cell in enumerate(self.cells):
+                if cell:
+                    table[i, :len(cell)] = [self.rows_of[b] for b in cell]
+            self.np_arrays = (boxes, table)
+        return self.np_arrays
+
+    def candidate_table(self, x, y, w, h):
+        # Vectorized counterpart of overlapping: for each box, the indices of
+        # the bricks in every cell it touches (-1 where there is none)
+        boxes, table = self.arrays()
+        t = self.tile_size
+        cx0 = np.maximum(np.floor_divide(x, t).astype(np.int64), self.min_cx)
+        cy0 = np.maximum(np.floor_divide(y, t).astype(np.int64), self.min_cy)
+        cx1 = np.minimum(np.floor_divide(x + w, t).astype(np.int64), self.min_cx + self.cols - 1)
+        cy1 = np.minimum(np.floor_divide(y + h, t).astype(np.int64), self.min_cy + self.rows - 1)
+        span_x = max(int((cx1 - cx0).max(initial=0)) + 1, 1)
+        span_y = max(int((cy1 - cy0).max(initial=0)) + 1, 1)
+        cx = cx0[:, None, None] + np.arange(span_x)[None, None, :]
+        cy = cy0[:, None, None] + np.arange(span_y)[None, :, None]
+        valid = (cx <= cx1[:, None, None]) & (cy <= cy1[:, None, None])
+        cell = np.where(valid, (cy - self.min_cy) * self.cols + (cx - self.min_cx), 0)
+        found = np.where(valid[..., None], table[cell], -1)
+        return found.reshape(len(x), -1)
+
+class StaticLayer:
+    # Sky, ground and bricks pre-rendered into fixed-width background chunks,
+    # so a frame only has to blit the visible chunk slices. Chunks are baked
+    # on first use and kept in a bounded LRU.
+    def __init__(self, tiles, height=500, chunk_width=500, max_chunks=16):
+        self.tiles = tiles
+        self.height = height
+        self.chunk_width = chunk_width
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+        self.bakes = 0
+        self.strip = (None, 0)  # (scroll, width) of the left edge strip, see draw
+
+    def chunk(self, i):
+        surface = self.chunks.get(i)
+        if surface is None:
+            surface = self.bake(i)
+            self.chunks[i] = surface
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(i)
+        return surface
+
+    def bake(self, i):
+        self.bakes += 1
+        profiler.count("surfaces")
+        left = i * self.chunk_width
+        surface = pygame.Surface((self.chunk_width, self.height))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self.paint(surface, left, 0, self.chunk_width)
+        return surface
+
+    def paint(self, g, scroll_pos_x, x, w):
+        # Sky, ground and bricks for the columns [x, x + w) of g, the way
+        # View's immediate path draws them
+        g.fill((135, 206, 235), (x, 0, w, self.height))  # Sky blue background
+        pygame.draw.rect(g, (0, 128, 0), (x, self.height - 25, w, 25))
+        bricks = self.tiles.overlapping(scroll_pos_x + x - 1, 0, w + 2, self.height)
+        g.blits([brick.blit_args(scroll_pos_x) for brick in bricks], doreturn=False)
+
+    def invalidate(self, x, w):
+        # Forget the chunks covering [x, x + w) so they get baked again
+        for i in range(int(x // self.chunk_width), int((x + w) // self.chunk_width) + 1):
+            self.chunks.pop(i, None)
+        self.strip = (None, 0)
+
+    def draw(self, g, rect, scroll_pos_x):
+        # Copy the background for a screen rect out of the chunks it spans
+        x, y, w, h = rect
+        # blit truncates a fractional screen x with int(); every brick
+        # starting right of the left edge lands this many px left of its x
+        edge = math.floor(scroll_pos_x) + 1
+        shift = edge - int(edge - scroll_pos_x)
+        left = x + shift
+        cw = self.chunk_width
+        for i in range(int(left // cw), int((left + w - 1) // cw) + 1):
+            chunk_left = i * cw
+            start = max(left, chunk_left)
+            end = min(left + w, chunk_left + cw)
+            g.blit(self.chunk(i), (start - shift, y), (start - chunk_left, y, end - start, h))
+        if shift == scroll_pos_x:
+            return
+        # Bricks crossing the left edge have a negative screen x, which
+        # int() truncates up instead: they sit a pixel right of the rest, so
+        # the strip they cover is drawn brick by brick
+        if self.strip[0] != scroll_pos_x:
+            crossing = [b for b in self.tiles.overlapping(scroll_pos_x, 0, 1, self.height) if b.x < scroll_pos_x]
+            self.strip = (scroll_pos_x, max((int(b.x - scroll_pos_x) + b.w for b in crossing), default=0))
+        strip = self.strip[1]
+        if not strip:
+            return
+        clip = pygame.Rect(rect).clip((0, 0, strip, self.height))
+        if clip:
+            old_clip = g.get_clip()
+            g.set_clip(clip)
+            self.paint(g, scroll_pos_x, 0, strip)
+            g.set_clip(old_clip)
+
+NO_SPAWN = -(1 << 62)  # spawn_id of batch rows that did not come from a level chunk
+
+class EntityBatch:
+    # Struct-of-arrays store for every sprite of one type, used by the numpy
+    # backend instead of one Python object per sprite. Each subclass mirrors
+    # the update and collision code of its Sprite class as array operations
+    # and lists its extra state in FIELDS as (name, dtype, initial value).
+    FIELDS = ()
+    HIT_BY_FIREBALLS = False
+    TOUCHES_LUIGI = False  # touch_luigi responds when Luigi overlaps a row
+    RESIZES_LUIGI = False  # and that response changes Luigi's box
+
+    def __init__(self):
+        for name in ("x", "y", "w", "h"):
+            setattr(self, name, np.zeros(0, dtype=float))
+        for name, dtype, value in self.FIELDS:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self.alive = np.zeros(0, dtype=bool)
+        self.spawn_id = np.zeros(0, dtype=np.int64)
+        # seq is each row's load order, kept across sleeping: in a Model it
+        # is the row's entity id, counted with the Sprites' orders, so rows
+        # of different batches resolve in the order the object loop would.
+        # slept_at is the tick a row in the dormant batch fell asleep.
+        self.seq = np.zeros(0, dtype=np.int64)
+        self.slept_at = np.zeros(0, dtype=np.int64)
+        self.next_seq = 0
+        self.dormant = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def columns(self):
+        return ("x", "y", "w", "h", "alive", "spawn_id", "seq", "slept_at") + tuple(f[0] for f in self.FIELDS)
+
+    def extend(self, x, y, w, h, spawn_ids=None, seq=None):
+        # Add sprites from equal-length columns of their boxes. seq must be
+        # increasing and after every row's so far; by default it counts on.
+        n = len(x)
+        if seq is None:
+            seq = np.arange(self.next_seq, self.next_seq + n)
+        values = {"x": x, "y": y, "w": w, "h": h, "alive": True,
+                  "spawn_id": NO_SPAWN if spawn_ids is None else spawn_ids,
+                  "seq": seq, "slept_at": 0}
+        if n:
+            self.next_seq = int(seq[-1]) + 1
+        values.update((name, value) for name, dtype, value in self.FIELDS)
+        for name in self.columns():
+            column = getattr(self, name)
+            added = np.broadcast_to(np.asarray(values[name], dtype=column.dtype), (n,))
+            setattr(self, name, np.concatenate((column, added)))
+
+    def append(self, x, y, w, h, spawn_id=None, seq=None):
+        self.extend([x], [y], [w], [h], None if spawn_id is None else [spawn_id],
+                    None if seq is None else [seq])
+
+    def compact(self):
+        # Drop the sprites that died this tick, keeping the rest in order.
+        # Returns the spawn ids of the dropped ones.
+        if self.alive.all():
+            return []
+        keep = self.alive
+        dead = self.spawn_id[~keep]
+        for name in self.columns():
+            setattr(self, name, getattr(self, name)[keep])
+        return dead[dead != NO_SPAWN].tolist()
+
+    def take(self, mask):
+        # Move the masked rows out into a new batch of the same type
+        rows = type(self)()
+        for name in self.columns():
+            column = getattr(self, name)
+            setattr(rows, name, column[mask])
+            setattr(self, name, column[~mask])
+        return rows
+
+    def merge(self, rows):
+        # Take back rows from take(), in load order
+        order = np.argsort(np.concatenate((self.seq, rows.seq)), kind="stable")
+        for name in self.columns():
+            setattr(self, name, np.concatenate((getattr(self, name), getattr(rows, name)))[order])
+
+    def sleep(self, left, right, tick):
+        # Move the rows entirely outside [left, right) to the dormant batch
+        far = self.alive & ((self.x + self.w <= left) | (self.x >= right))
+        if not far.any():
+            return
+        rows = self.take(far)
+        rows.slept_at[:] = tick
+        if self.dormant is None:
+            self.dormant = rows
+        else:
+            self.dormant.merge(rows)
+
+    def wake(self, model, left, right, tick, catch_up):
+        dormant = self.dormant
+        if dormant is None or not len(dormant):
+            return
+        near = (dormant.x + dormant.w > left) & (dormant.x < right)
+        if not near.any():
+            return
+        rows = dormant.take(near)
+        if catch_up:
+            rows.catch_up(model, np.minimum(tick - rows.slept_at, catch_up))
+        self.merge(rows)
+
+    def catch_up(self, model, ticks):
+        # Replay each row's own movement and collisions for its number of
+        # ticks; rows that are done sit out the remaining rounds as dead rows
+        columns = self.columns()
+        for r in range(int(ticks.max())):
+            done = ticks <= r
+            saved = {name: getattr(self, name)[done] for name in columns}
+            self.alive[done] = False
+            self.update()
+            self.collide(model)
+            model.hit_fireballs([self])
+            for name in columns:
+                getattr(self, name)[done] = saved[name]
+
+    def overlapping(self, x, y, w, h):
+        return (self.alive & (self.x + self.w > x) & (self.x < x + w)
+                & (self.y + self.h > y) & (self.y < y + h))
+
+    def update(self):
+        pass
+
+    def respond(self, i, bx, by, bw, bh):
+        pass
+
+    def collide(self, model, rows=None):
+        # Resolve every sprite (or those in the rows mask) against the bricks
+        # it overlaps, one brick at a time in load order, exactly like the
+        # object loop: each round picks for every sprite the first
+        # overlapping brick after the one it handled last round, using the
+        # positions earlier responses left.
+        if not len(self) or not len(model.tiles):
+            return
+        active = np.nonzero(self.alive if rows is None else self.alive & rows)[0]
+        if not active.size:
+            return
+        boxes = model.tiles.arrays()[0]
+        last = np.full(len(self), -1, dtype=np.int64)
+        while active.size:
+            x, y, w, h = self.x[active], self.y[active], self.w[active], self.h[active]
+            found = model.tiles.candidate_table(x, y, w, h)
+            model.pairs_tested += int((found >= 0).sum())
+            b = boxes[found]
+            hit = ((found > last[active, None])
+                   & (x[:, None] + w[:, None] > b[..., 0]) & (x[:, None] < b[..., 0] + b[..., 2])
+                   & (y[:, None] + h[:, None] > b[..., 1]) & (y[:, None] < b[..., 1] + b[..., 3]))
+            first = np.where(hit, found, len(boxes)).min(axis=1)
+            more = first < len(boxes)
+            active = active[more]
+            first = first[more]
+            self.respond(active, *boxes[first].T)
+            model.collisions += len(active)
+            last[active] = first
+
+    def burn(self, i):
+        pass
+
+    def touch_luigi(self, model, rows):
+        # Luigi touched these rows (see TOUCHES_LUIGI)
+        pass
+
+    def expire(self, model):
+        pass
+
+    def image_at(self, i):
+        return self.image, False
+
+    def draw(self, g, scroll_pos_x, width, height, previous=None, lag=0.0):
+        # Blit the sprites inside the window, returning their screen rects.
+        # previous is (seq, x, y) of the rows as of the last tick: each row
+        # found there is drawn lag of the way back to where it was.
+        visible = np.nonzero(self.overlapping(scroll_pos_x, 0, width, height))[0]
+        x = self.x[visible]
+        y = self.y[visible]
+        if lag and previous is not None and len(previous[0]):
+            # seq stays sorted, so rows are matched up by binary search
+            seq, px, py = previous
+            j = np.minimum(np.searchsorted(seq, self.seq[visible]), len(seq) - 1)
+            known = seq[j] == self.seq[visible]
+            x = np.where(known, x - (x - px[j]) * lag, x)
+            y = np.where(known, y - (y - py[j]) * lag, y)
+        blits = []
+        rects = []
+        for i, x, y in zip(visible.tolist(), (x - scroll_pos_x).tolist(), y.tolist()):
+            image, flip = self.image_at(i)
+            w, h = int(self.w[i]), int(self.h[i])
+            sheet, area = transforms.region(image, w, h, flip)
+            blits.append((sheet, (x, y), area))
+            rects.append(pygame.Rect(int(x) - 1, int(y) - 1, w + 2, h + 2))
+        g.blits(blits, doreturn=False)
+        return rects
+
+class MushroomBatch(EntityBatch):
+    FIELDS = (("vert_velocity", float, 2.2),)
+    TOUCHES_LUIGI = True
+    RESIZES_LUIGI = True
+
     def __init__(self):
-        self.sprites = []
+        super().__init__()
+        self.image = assets.load("images/mushroom.png")
+
+    def update(self):
+        self.y += self.vert_velocity
+        landed = self.y > 500
+        self.y[landed] = 500
+        self.vert_velocity[landed] = 0
+
+    def respond(self, i, bx, by, bw, bh):
+        # Every overlap meets the y + h >= b.y test of Mushroom.collision
+        self.y[i] = by - self.h[i]
+        self.vert_velocity[i] = 0
+
+    def touch_luigi(self, model, rows):
+        # Model.touch_luigi hands over one mushroom at a time, since eating
+        # changes Luigi's box
+        for i in rows:
+            model.luigi.eat_mushroom()
+        self.alive[rows] = False
+
+class GoombaBatch(EntityBatch):
+    FIELDS = (("vert_velocity", float, 0.0), ("velocity_x", float, 1.5),
+              ("on_fire", bool, False), ("fire_counter", np.int64, 0),
+              ("collided", bool, False), ("collided2", bool, False),
+              ("collision_direction", np.int8, 0))  # -1 left, 1 right
+    HIT_BY_FIREBALLS = True
+
+    def __init__(self):
+        super().__init__()
+        self.image = assets.load("images/goomba.png")
+
+    def update(self):
+        self.vert_velocity += 2.2
+        self.y += self.vert_velocity
+        c = self.collided
+        self.vert_velocity[c] = 0
+        self.x[c] += self.velocity_x[c]
+        c2 = self.collided2
+        left = c2 & (self.collision_direction == -1)
+        self.velocity_x[left] = -np.abs(self.velocity_x[left])
+        self.x[left] += self.velocity_x[left]
+        right = c2 & (self.collision_direction == 1)
+        self.velocity_x[right] = np.abs(self.velocity_x[right])
+        self.x[right] += self.velocity_x[right]
+        self.vert_velocity[c2] = 0
+        self.collision_direction[c2] = 0
+        self.collided2[:] = False
+        self.fire_counter[self.fire_counter > 0] -= 1
+
+    def respond(self, i, bx, by, bw, bh):
+        x, y, w, h = self.x[i], self.y[i], self.w[i], self.h[i]
+        top = (y + h >= by) & (y < by)
+        left_side = (x + w >= bx) & (x < bx)
+        right_side = (x <= bx + bw) & (x + w > bx + bw)
+        side = ~top & (y + h > by) & (y < by + bh)
+        t = i[top]
+        self.y[t] = (by - h)[top]
+        self.vert_velocity[t] = 0
+        self.collided[t] = True
+        left = i[side & left_side]
+        self.collided2[left] = True
+        self.collision_direction[left] = -1
+        right = i[side & ~left_side & right_side]
+        self.collided2[right] = True
+        self.collision_direction[right] = 1
+
+    def burn(self, i):
+        i = i[~self.on_fire[i]]
+        self.on_fire[i] = True
+        self.fire_counter[i] = 60
+        self.velocity_x[i] = 0
+
+    def expire(self, model):
+        self.alive &= self.fire_counter != 1
+
+    def image_at(self, i):
+        return (Goomba.FIRE[0] if self.on_fire[i] else self.image), False
+
+class DryBonesBatch(EntityBatch):
+    FIELDS = (("vert_velocity", float, 0.0), ("velocity_x", float, -1.5),
+              ("collided", bool, False), ("collided2", bool, False),
+              ("knock_out", bool, False), ("knock_out_counter", np.int64, 0),
+              ("frame_counter", np.int64, 0), ("flip", bool, False),
+              ("image_num", np.int64, 0))
+    HIT_BY_FIREBALLS = True
+    TOUCHES_LUIGI = True
+    FRAMES = DryBones.FRAMES
+
+    def update(self):
+        self.vert_velocity += 2.2
+        self.y += self.vert_velocity
+        c = self.collided
+        self.vert_velocity[c] = 0
+        self.x[c] += self.velocity_x[c]
+        c2 = self.collided2
+        self.velocity_x[c2] = -self.velocity_x[c2]
+        self.x[c2] += self.velocity_x[c2]
+        self.vert_velocity[c2] = 0
+        self.flip[c2] = ~self.flip[c2]
+        self.collided2[:] = False
+        k = self.knock_out
+        self.knock_out_counter[k] -= 1
+        self.velocity_x[k] = 0
+        up = k & (self.knock_out_counter == 0)
+        self.knock_out[up] = False
+        self.image_num[up] = 0
+        self.velocity_x[up] = np.where(self.flip[up], 1.5, -1.5)
+        self.x[up] += self.velocity_x[up]
+
+        self.frame_counter += 1
+        step = ~self.knock_out & (self.frame_counter % self.FRAMES.ticks == 0)
+        self.image_num[step] += 1
+        self.image_num[step & (self.image_num >= self.FRAMES.cycle)] = 0
+
+    def respond(self, i, bx, by, bw, bh):
+        x, y, w, h = self.x[i], self.y[i], self.w[i], self.h[i]
+        top = (y + h >= by) & (y < by)
+        left_side = (x + w >= bx) & (x < bx)
+        right_side = (x <= bx + bw) & (x + w > bx + bw)
+        side = ~top & (y + h > by) & (y < by + bh)
+        t = i[top]
+        self.y[t] = (by - h)[top]
+        self.vert_velocity[t] = 0
+        self.collided[t] = True
+        left = side & left_side
+        self.x[i[left]] = (bx - w)[left]
+        right = side & ~left_side & right_side
+        self.x[i[right]] = (bx + bw)[right]
+        self.collided2[i[left | right]] = True
+
+    def burn(self, i):
+        self.knocked(i)
+
+    def knocked(self, i):
+        i = i[~self.knock_out[i]]
+        self.knock_out[i] = True
+        self.knock_out_counter[i] = 180
+
+    def touch_luigi(self, model, rows):
+        self.knocked(rows)
+
+    def image_at(self, i):
+        # knocked() shows the last frame until the sprite gets back up
+        frame = DryBones.KNOCKED if self.knock_out[i] else self.image_num[i]
+        return self.FRAMES[frame], bool(self.flip[i])
+
+class FireballBatch(EntityBatch):
+    FIELDS = (("vert_velocity", float, 2.2), ("velocity_x", float, 15.0))
+
+    def __init__(self):
+        super().__init__()
+        self.image = assets.load("images/fireball.png")
+
+    def update(self):
+        self.x += self.velocity_x
+        self.y += self.vert_velocity
+        self.vert_velocity[self.y + self.h >= 400] += -6
+        self.vert_velocity += 2
+
+    def collide(self, model, rows=None):
+        pass
+
+    def expire(self, model):
+        self.alive &= ~((self.x > model.luigi.x + 600) | (self.x < model.luigi.x - 100))
+
+# Collision responses keyed by (tag of the moving sprite, tag of what it
+# touched). Pairs without a handler are never even tested.
+COLLISIONS = {}
+COLLIDES_WITH = {}
+
+def collision(tag_a, tag_b):
+    def register(handler):
+        COLLISIONS[(tag_a, tag_b)] = handler
+        COLLIDES_WITH.setdefault(tag_a, set()).add(tag_b)
+        return handler
+    return register
+
+@collision(TAG_LUIGI, TAG_BRICK)
+def luigi_hits_brick(model, luigi, brick):
+    luigi.collision(brick)
+
+@collision(TAG_LUIGI, TAG_DRY_BONES)
+def luigi_hits_dry_bones(model, luigi, dry_bones):
+    dry_bones.knocked()
+
+@collision(TAG_LUIGI, TAG_MUSHROOM)
+def luigi_eats_mushroom(model, luigi, mushroom):
+    luigi.eat_mushroom()
+    model.despawn(mushroom)
+
+@collision(TAG_MUSHROOM, TAG_BRICK)
+@collision(TAG_GOOMBA, TAG_BRICK)
+@collision(TAG_DRY_BONES, TAG_BRICK)
+def lands_on_brick(model, sprite, brick):
+    sprite.collision(brick)
+
+@collision(TAG_GOOMBA, TAG_FIREBALL)
+def goomba_burns(model, goomba, fireball):
+    goomba.catch_fire()
+    model.despawn(fireball)  # Remove fireball after hitting
+
+@collision(TAG_DRY_BONES, TAG_FIREBALL)
+def dry_bones_burns(model, dry_bones, fireball):
+    dry_bones.knocked()
+    model.despawn(fireball)  # Remove fireball after hitting
+
+class Model:
+    # How the map.json entry lists turn into Sprites
+    SPAWNS = {
+        "drybones": (DryBones, "images/drybones1.png"),
+        "mushrooms": (Mushroom, "images/mushroom.png"),
+        "goombas": (Goomba, "images/goomba.png"),
+    }
+
+    def __init__(self, map_file="map.json", backend="objects", lazy=False):
+        if backend not in ("objects", "numpy"):
+            raise ValueError("unknown entity backend %r" % backend)
+        if backend == "numpy" and np is None:
+            raise ImportError("the numpy entity backend needs numpy installed")
+        self.backend = backend
+        # Moving sprites by entity id (their order), which keeps them in the
+        # order they were added and removes them in O(1)
+        self.sprites = {}
+        self.despawned = []
+        # The numpy backend keeps the enemies, mushrooms and fireballs in
+        # EntityBatch arrays; Luigi always stays a Sprite
+        self.batches = []
+        self.fireballs = None
+        self.grid = SpatialHash(50)
+        self.next_order = 0
+        # Bricks count from far below zero so they always sort before every
+        # moving sprite, however late they are loaded
+        self.next_brick_order = -(1 << 60)
+        self.pairs_tested = 0  # narrowphase tests in the last update
+        self.removed = 0  # entities eaten, burnt, out of range or streamed out
+        self.collisions = 0  # collision responses in the last update
+        self.tile_listeners = []  # called with (x, w) when bricks there change
+        self.ground = []
         for i in range(28):
-            self.sprites.append(Brick((i-10)*50, 450, 50, 50, "images/Brick.png"))
-        
-        with open("map.json") as file:
-            data = json.load(file)
-            bricks = data["bricks"]
-            Drybones = data["drybones"]
-            Mushrooms = data["mushrooms"]
-            Goombas = data["goombas"]
-        file.close()
-
-        for entry in bricks:
-            self.sprites.append(Brick(entry["x"], entry["y"], entry["w"], entry["h"], "images/Brick.png"))
-        for entry in Drybones:
-            self.sprites.append(DryBones(entry["x"], entry["y"], entry["w"], entry["h"], "images/drybones1.png"))
-        for entry in Mushrooms:
-            self.sprites.append(Mushroom(entry["x"], entry["y"], entry["w"], entry["h"], "images/mushroom.png"))   
-        for entry in Goombas:
-            self.sprites.append(Goomba(entry["x"], entry["y"], entry["w"], entry["h"], "images/goomba.png"))
+            self.ground.append(self.make_brick((i-10)*50, 450, 50, 50))
+
+        # A chunked level only has its index read here; its chunks stream in
+        # around Luigi from update()
+        self.level = None
+        self.loaded_chunks = {}
+        self.live_spawns = set()
+        self.consumed = set()  # spawn ids eaten or burnt, never spawned again
+        self.stream_ahead = 2000
+        self.stream_behind = 1000
+        # With a sleep_margin, entities further than that many px outside
+        # the viewport sleep: no update and no collisions until they come
+        # back into range. Woken entities replay up to catch_up of the ticks
+        # they missed.
+        self.sleep_margin = None
+        self.catch_up = 0
+        self.viewport = (0, 1000)
+        self.sleeping = {}  # column of sleep_column px -> {order: (sprite, tick)}
+        self.sleep_column = 500
+        self.ticks = 0
+        # Map entry (kind, x, y, w, h) of each spawn id of a whole-file level,
+        # for the editor; None once the editor removed it
+        self.spawns = []
+        # With lazy, the object backend only makes Sprites for the spawns
+        # around the first screen up front. Every other spawn sleeps from the
+        # first tick on, so it stays a map entry until it wakes up or
+        # load_unloaded() gets to it, and the game plays out the same.
+        self.unloaded = {}  # column of sleep_column px -> {order: (kind, x, y, w, h)}
+        if levels.is_chunked(map_file):
+            self.level = levels.ChunkedLevel(map_file)
+            data = {}
+        else:
+            if levels.is_binary(map_file):
+                data = levels.read_binary(map_file)
+            else:
+                with open(map_file) as file:
+                    data = json.load(file)
+
+        bricks = list(self.ground)
+        for x, y, w, h in zip(*levels.boxes(data.get("bricks", []))):
+            bricks.append(self.make_brick(x, y, w, h))
+        # Bricks never move, so they live in their own grid instead of
+        # self.sprites and cost nothing per frame
+        self.tiles = TileGrid(bricks, 50)
+
+        if backend == "numpy":
+            self.batches = [DryBonesBatch(), MushroomBatch(), GoombaBatch()]
+            self.fireballs = FireballBatch()
+        for kind in ("drybones", "mushrooms", "goombas"):
+            x, y, w, h = levels.boxes(data.get(kind, []))
+            first = len(self.spawns)
+            self.spawns.extend((kind,) + box for box in zip(x, y, w, h))
+            if backend == "numpy":
+                self.batch_for(kind).extend(x, y, w, h, range(first, len(self.spawns)),
+                                            self.take_orders(len(x)))
+            elif lazy:
+                left, right = self.viewport[0] - self.viewport[1], self.viewport[0] + 2 * self.viewport[1]
+                for spawn_id, box in enumerate(zip(x, y, w, h), first):
+                    if box[0] + box[2] > left and box[0] < right:
+                        sprite = self.make_sprite(kind, *box, spawn_id)
+                        self.sprites[sprite.order] = sprite
+                        self.grid.insert(sprite)
+                    else:
+                        column = self.unloaded.setdefault(int(box[0] // self.sleep_column), {})
+                        column[spawn_id] = (kind,) + box
+            else:
+                for spawn_id, box in enumerate(zip(x, y, w, h), first):
+                    self.spawn(kind, *box, spawn_id)
+        if lazy and backend == "objects":
+            # The unloaded spawns keep their orders
+            self.next_order = len(self.spawns)
         
         # Add player
         self.luigi = Luigi(100, 50, 25, 50, "images/luigi1.png")
-        self.sprites.append(self.luigi)
+        self.add_sprite(self.luigi)
+        # The same bound for a level whatever format it is stored in
+        width = self.level.width if self.level is not None else levels.level_width(data)
+        self.luigi.level_width = max(2000, width)
+        if self.level is not None:
+            self.stream(self.luigi.x)
         
+    def make_brick(self, x, y, w, h):
+        brick = Brick(x, y, w, h, "images/brick.png")
+        brick.order = self.next_brick_order
+        self.next_brick_order += 1
+        return brick
+
+    def add_sprite(self, sprite):
+        # order doubles as the sprite's entity id; it only ever grows, so
+        # sorting by it reproduces the order sprites were added in
+        sprite.order = self.next_order
+        self.next_order += 1
+        self.sprites[sprite.order] = sprite
+        self.grid.insert(sprite)
+
+    def take_orders(self, n):
+        # Entity ids for n batch rows (their seq), from the same count as
+        # the Sprites' orders
+        first = self.next_order
+        self.next_order += n
+        return range(first, self.next_order)
+
+    def make_sprite(self, kind, x, y, w, h, spawn_id):
+        # The Sprite of a whole-file level's spawn, outside the model. Loaded
+        # up front its order would have been its spawn id, so it is here too.
+        cls, image = self.SPAWNS[kind]
+        sprite = cls(x, y, w, h, image)
+        sprite.order = sprite.spawn_id = spawn_id
+        return sprite
+
+    def load_unloaded(self, seconds=None):
+        # Make the unloaded spawns into sleeping sprites ahead of time, the
+        # columns nearest the viewport first, for at most `seconds`. Returns
+        # whether any are left.
+        if self.sleep_margin is None:
+            return bool(self.unloaded)  # next update wakes them all anyway
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        x, w = self.viewport
+        cw = self.sleep_column
+        for c in sorted(self.unloaded, key=lambda c: abs((c + 0.5) * cw - x - w / 2)):
+            if not self.load_column(c, deadline):
+                break
+        return bool(self.unloaded)
+
+    def load_column(self, c, deadline=None):
+        # File a column's unloaded spawns into its sleeping column as sprites
+        # asleep since tick 0. Returns False if the deadline ran out first.
+        records = self.unloaded[c]
+        column = self.sleeping.setdefault(c, {})
+        done = True
+        for order in list(records):
+            kind, x, y, w, h = records.pop(order)
+            column[order] = (self.make_sprite(kind, x, y, w, h, order), 0)
+            if deadline is not None and records and time.perf_counter() > deadline:
+                done = False
+                break
+        if not records:
+            del self.unloaded[c]
+        # Loaded up front they would have fallen asleep in load order on the
+        # first tick, ahead of anything that fell asleep later
+        self.sleeping[c] = dict(sorted(column.items(), key=lambda item: (item[1][1], item[0])))
+        return done
+
+    def wake_unloaded(self):
+        # Nothing sleeps without a sleep_margin, so every spawn is awake
+        for c in list(self.unloaded):
+            for order, (kind, x, y, w, h) in self.unloaded.pop(c).items():
+                sprite = self.make_sprite(kind, x, y, w, h, order)
+                self.sprites[order] = sprite
+                self.grid.insert(sprite)
+        self.sprites = dict(sorted(self.sprites.items()))
+
+    def batch_for(self, kind):
+        return self.batches[("drybones", "mushrooms", "goombas").index(kind)]
+
+    def spawn(self, kind, x, y, w, h, spawn_id=None):
+        # Add one entry of a map's "drybones", "mushrooms" or "goombas" list
+        if self.backend == "numpy":
+            self.batch_for(kind).append(x, y, w, h, spawn_id, self.take_orders(1)[0])
+        else:
+            cls, image = self.SPAWNS[kind]
+            sprite = cls(x, y, w, h, image)
+            sprite.spawn_id = spawn_id
+            self.add_sprite(sprite)
+        if spawn_id is not None:
+            self.live_spawns.add(spawn_id)
+
+    def stream(self, x):
+        # Load the chunks from stream_behind px left of x to stream_ahead px
+        # right of it; chunks are evicted once a further chunk out of range
+        cw = self.level.chunk_width
+        first = int((x - self.stream_behind) // cw)
+        last = int((x + self.stream_ahead) // cw)
+        changed = []
+        for i in range(first, last + 1):
+            if i not in self.loaded_chunks:
+                self.load_chunk(i)
+                changed.append(i)
+        for i in list(self.loaded_chunks):
+            if i < first - 1 or i > last + 1:
+                self.evict_chunk(i)
+                changed.append(i)
+        if changed:
+            bricks = list(self.ground)
+            for chunk in self.loaded_chunks.values():
+                bricks.extend(chunk)
+            bricks.sort(key=lambda b: b.order)
+            self.tiles = TileGrid(bricks, 50)
+            for i in changed:
+                self.tiles_changed(i * cw, cw)
+
+    def load_chunk(self, i):
+        data = self.level.read(i) or {}
+        self.loaded_chunks[i] = [self.make_brick(e["x"], e["y"], e["w"], e["h"])
+                                 for e in data.get("bricks", [])]
+        # Spawn ids stay the same every time a chunk loads, so enemies that
+        # are still alive elsewhere are not spawned twice, nor the ones
+        # Luigi already got rid of
+        k = 0
+        for kind in ("drybones", "mushrooms", "goombas"):
+            for entry in data.get(kind, []):
+                spawn_id = i * 1000000 + k
+                k += 1
+                if spawn_id not in self.live_spawns and spawn_id not in self.consumed:
+                    self.spawn(kind, entry["x"], entry["y"], entry["w"], entry["h"], spawn_id)
+
+    def evict_chunk(self, i):
+        # Drop the chunk's bricks and every sprite now standing in it
+        del self.loaded_chunks[i]
+        left = i * self.level.chunk_width
+        right = left + self.level.chunk_width
+        for sprite in self.sprites.values():
+            if sprite is not self.luigi and left <= sprite.x < right:
+                self.despawn(sprite)
+        self.flush_despawned(consumed=False)
+        for column in self.sleeping.values():
+            for order, (sprite, tick) in list(column.items()):
+                if left <= sprite.x < right:
+                    del column[order]
+                    self.live_spawns.discard(sprite.spawn_id)
+                    self.removed += 1
+        for batch in self.all_batches() + self.dormant_batches():
+            batch.alive &= (batch.x < left) | (batch.x >= right)
+            self.compact(batch, consumed=False)
+
+    def set_viewport(self, x, w):
+        self.viewport = (x, w)
+
+    def update_sleep(self):
+        # Put the Goombas, DryBones and Mushrooms out of range to sleep and
+        # wake the sleeping ones back in range. Fireballs and Luigi never sleep.
+        x, w = self.viewport
+        left = x - self.sleep_margin
+        right = x + w + self.sleep_margin
+        cw = self.sleep_column
+        for sprite in list(self.sprites.values()):
+            if sprite.tag in SLEEPERS and (sprite.x + sprite.w <= left or sprite.x >= right):
+                del self.sprites[sprite.order]
+                self.grid.remove(sprite)
+                self.sleeping.setdefault(int(sprite.x // cw), {})[sprite.order] = (sprite, self.ticks)
+        woken = []
+        # Start a column early for sprites reaching over the left edge
+        for c in range(int(left // cw) - 1, int(right // cw) + 1):
+            if c in self.unloaded:
+                self.load_column(c)
+            column = self.sleeping.get(c)
+            if not column:
+                continue
+            for order, (sprite, tick) in list(column.items()):
+                if sprite.x + sprite.w > left and sprite.x < right:
+                    del column[order]
+                    woken.append((sprite, tick))
+        if woken:
+            for sprite, tick in woken:
+                self.sprites[sprite.order] = sprite
+                self.grid.insert(sprite)
+            # Back into load order, which update and collide rely on
+            self.sprites = dict(sorted(self.sprites.items()))
+            for sprite, tick in woken:
+                for _ in range(min(self.ticks - tick, self.catch_up)):
+                    sprite.update()
+                    self.grid.move(sprite)
+                    if sprite in self.grid:
+                        self.collide(sprite)
+            self.flush_despawned()
+        for batch in self.batches:
+            batch.sleep(left, right, self.ticks)
+            batch.wake(self, left, right, self.ticks, self.catch_up)
+
+    def dormant_batches(self):
+        return [batch.dormant for batch in self.batches if batch.dormant is not None]
+
     def update(self):
-        # Create a copy of sprites to iterate safely
-        sprites_to_update = self.sprites.copy()
+        if self.level is not None:
+            self.stream(self.luigi.x)
+        if self.sleep_margin is not None:
+            self.update_sleep()
+        elif self.unloaded:
+            self.wake_unloaded()
+        self.ticks += 1
+
+        # Take a copy so sprites can be added while iterating
+        sprites_to_update = list(self.sprites.values())
         
         for sprite in sprites_to_update:
             sprite.update()
+            self.grid.move(sprite)
+        batches = self.all_batches()
+        for batch in batches:
+            batch.update()
+        profiler.mark("entities")
         
-        for i in range(len(self.sprites)):
-            for s in range(len(self.sprites)):
-                if i != s and i < len(self.sprites) and s < len(self.sprites) and self.sprites[i].collides_with(self.sprites[s]):
-                    if self.sprites[i].is_luigi() and self.sprites[s].is_brick():
-                        self.luigi.collision(self.sprites[s])
-                    elif self.sprites[i].is_luigi() and self.sprites[s].is_dry_bones():
-                        self.sprites[s].knocked()
-                    elif self.sprites[i].is_mushroom() and self.sprites[s].is_brick():
-                        self.sprites[i].collision(self.sprites[s])
-                    elif self.sprites[i].is_goomba() and self.sprites[s].is_brick():
-                        self.sprites[i].collision(self.sprites[s])
-                    elif self.sprites[i].is_goomba() and self.sprites[s].is_fireball():
-                        self.sprites[i].catch_fire()
-                        self.remove_sprite(s)  # Remove fireball after hitting
-                    elif self.sprites[i].is_dry_bones() and self.sprites[s].is_brick():
-                        self.sprites[i].collision(self.sprites[s])
-                    elif self.sprites[i].is_dry_bones() and self.sprites[s].is_fireball():
-                        self.sprites[i].knocked()
-                        self.remove_sprite(s)  # Remove fireball after hitting
-                    elif self.sprites[i].is_luigi() and self.sprites[s].is_mushroom():
-                        self.luigi.eat_mushroom()
-                        self.remove_sprite(s)
+        self.pairs_tested = 0
+        self.collisions = 0
+        # Resolve in load order, as the object loop would: the rows loaded
+        # before Luigi land on their bricks, then Luigi handles his bricks
+        # and whatever he touches, then the rows loaded after him land.
+        # Fireball hits only burn, so they can all wait until the end.
+        luigi = self.luigi.order
+        for batch in batches:
+            batch.collide(self, batch.seq < luigi)
+        for sprite in sprites_to_update:
+            if sprite.tag in COLLIDES_WITH and sprite in self.grid:
+                self.collide(sprite)
+        self.touch_luigi(batches)
+        for batch in batches:
+            batch.collide(self, batch.seq > luigi)
+        self.hit_fireballs(batches)
+        profiler.count("pairs_tested", self.pairs_tested)
+        profiler.count("collisions", self.collisions)
+        profiler.mark("collision")
         
         # Check for sprites that need to be removed
-        for s in range(len(self.sprites)-1, -1, -1):
-            if s < len(self.sprites):  # Make sure we're still in bounds
-                if self.sprites[s].is_fireball():
-                    if self.sprites[s].x > self.luigi.x + 600 or self.sprites[s].x < self.luigi.x - 100:
-                        self.remove_sprite(s)
-                elif self.sprites[s].is_goomba():
-                    if hasattr(self.sprites[s], 'disappear') and self.sprites[s].disappear():
-                        self.remove_sprite(s)
-                        
+        for sprite in sprites_to_update:
+            if sprite.tag == TAG_FIREBALL:
+                if sprite.x > self.luigi.x + 600 or sprite.x < self.luigi.x - 100:
+                    self.despawn(sprite)
+            elif sprite.tag == TAG_GOOMBA:
+                if sprite.disappear():
+                    self.despawn(sprite)
+        self.flush_despawned()
+        for batch in batches:
+            batch.expire(self)
+            self.compact(batch)
+        profiler.mark("removal")
+
+    def candidates(self, sprite, after):
+        # Broadphase candidates later in load order than `after` that the
+        # sprite has a collision handler for, sorted so that pop() hands
+        # them out in order
+        wanted = COLLIDES_WITH[sprite.tag]
+        found = {s for s in self.grid.query(sprite.x, sprite.y, sprite.w, sprite.h)
+                 if s.tag in wanted and s.order > after}
+        found.discard(sprite)
+        if TAG_BRICK in wanted:
+            found.update(b for b in self.tiles.overlapping(sprite.x, sprite.y, sprite.w, sprite.h)
+                         if b.order > after)
+        return sorted(found, key=lambda s: s.order, reverse=True)
+
+    def collide(self, sprite):
+        box = (sprite.x, sprite.y, sprite.w, sprite.h)
+        candidates = self.candidates(sprite, -math.inf)
+        while candidates:
+            other = candidates.pop()
+            self.pairs_tested += 1
+            if not (other.tag == TAG_BRICK or other in self.grid) or not sprite.collides_with(other):
+                continue
+            COLLISIONS[(sprite.tag, other.tag)](self, sprite, other)
+            self.collisions += 1
+            if sprite not in self.grid:
+                return
+            if (sprite.x, sprite.y, sprite.w, sprite.h) != box:
+                # The response moved the sprite, so it may now reach cells
+                # the first query did not cover
+                box = (sprite.x, sprite.y, sprite.w, sprite.h)
+                self.grid.move(sprite)
+                candidates = self.candidates(sprite, other.order)
+
+    def sprites_in(self, x, y, w, h):
+        # Moving sprites overlapping the box, in list order
+        found = [s for s in self.grid.query(x, y, w, h)
+                 if s.x + s.w > x and s.x < x + w and s.y + s.h > y and s.y < y + h]
+        found.sort(key=lambda s: s.order)
+        return found
+
+    def touch_luigi(self, batches):
+        # Luigi's responses to the batch rows he overlaps, in load order.
+        # Eating a mushroom resizes him, so the rows after the first
+        # mushroom he eats are checked again against his new box.
+        batches = [batch for batch in batches if batch.TOUCHES_LUIGI and len(batch)]
+        luigi = self.luigi
+        after = -1
+        while batches:
+            touched = []
+            stop = None
+            for batch in batches:
+                self.pairs_tested += len(batch)
+                rows = np.nonzero(batch.alive & (batch.seq > after)
+                                  & batch.overlapping(luigi.x, luigi.y, luigi.w, luigi.h))[0]
+                touched.append(rows)
+                if batch.RESIZES_LUIGI and rows.size:
+                    first = batch.seq[rows[0]]
+                    stop = first if stop is None else min(stop, first)
+            for batch, rows in zip(batches, touched):
+                if stop is not None:
+                    rows = rows[batch.seq[rows] <= stop]
+                if rows.size:
+                    batch.touch_luigi(self, rows)
+                    self.collisions += rows.size
+            if stop is None:
+                return
+            after = stop
+
+    def hit_fireballs(self, batches):
+        # Each fireball is used up by the first sprite, in load order, it
+        # touches
+        fireballs = self.fireballs
+        if fireballs is None:
+            return
+        f = np.nonzero(fireballs.alive)[0]
+        if not f.size:
+            return
+        none = np.iinfo(np.int64).max
+        first = np.full(f.size, none)
+        hits = []
+        for batch in batches:
+            if not batch.HIT_BY_FIREBALLS or not len(batch):
+                continue
+            self.pairs_tested += f.size * len(batch)
+            touching = (batch.alive[None, :]
+                        & (fireballs.x[f, None] + fireballs.w[f, None] > batch.x[None, :])
+                        & (fireballs.x[f, None] < batch.x[None, :] + batch.w[None, :])
+                        & (fireballs.y[f, None] + fireballs.h[f, None] > batch.y[None, :])
+                        & (fireballs.y[f, None] < batch.y[None, :] + batch.h[None, :]))
+            # seq only grows along a batch, so argmax finds each fireball's
+            # first touching row
+            row = touching.argmax(axis=1)
+            seq = np.where(touching.any(axis=1), batch.seq[row], none)
+            hits.append((batch, row, seq))
+            first = np.minimum(first, seq)
+        used = first < none
+        if not used.any():
+            return
+        for batch, row, seq in hits:
+            mine = used & (seq == first)
+            if mine.any():
+                batch.burn(np.unique(row[mine]))
+        fireballs.alive[f[used]] = False
+        self.collisions += int(used.sum())
+
+    def tiles_changed(self, x, w):
+        for listener in self.tile_listeners:
+            listener(x, w)
+
+    def add_item(self, kind, x, y, w, h):
+        # Editor add of one entry of the map's `kind` list. Returns the entry
+        # to save, or None for a fireball (not part of a level) or a brick
+        # already there.
+        if kind == "bricks":
+            if any((b.x, b.y, b.w, b.h) == (x, y, w, h) for b in self.tiles.overlapping(x, y, w, h)):
+                return None
+            self.tiles.add(self.make_brick(x, y, w, h))
+            self.tiles_changed(x, w)
+        elif kind == "fireballs":
+            if self.fireballs is not None:
+                self.fireballs.append(x, y, w, h, seq=self.take_orders(1)[0])
+            else:
+                self.add_sprite(Fireball(x, y, w, h, "images/fireball.png"))
+            return None
+        else:
+            self.spawns.append((kind, x, y, w, h))
+            self.spawn(kind, x, y, w, h, len(self.spawns) - 1)
+        return levels.make_entry(kind, x, y, w, h)
+
+    def remove_at(self, x, y):
+        # Editor remove of the item at (x, y): the last loaded moving sprite
+        # there, fireballs included, then a brick; Luigi and the ground
+        # stay. Returns the (kind, entry) to drop from the map, or None.
+        for sprite in reversed(self.sprites_in(x, y, 1, 1)):
+            if sprite is not self.luigi:
+                self.despawn(sprite)
+                self.flush_despawned()
+                return self.forget_spawn(sprite.spawn_id)
+        # The batch rows' seq is their load order across batches
+        top = None
+        for batch in self.all_batches():
+            rows = np.nonzero(batch.overlapping(x, y, 1, 1))[0]
+            if rows.size and (top is None or batch.seq[rows[-1]] > top[0].seq[top[1]]):
+                top = batch, rows[-1]
+        if top is not None:
+            batch, row = top
+            spawn_id = int(batch.spawn_id[row])
+            batch.alive[row] = False
+            self.compact(batch)
+            return None if batch is self.fireballs else self.forget_spawn(spawn_id)
+        for brick in reversed(self.tiles.overlapping(x, y, 1, 1)):
+            if brick not in self.ground:
+                self.tiles.remove(brick)
+                self.tiles_changed(brick.x, brick.w)
+                return "bricks", levels.make_entry("bricks", brick.x, brick.y, brick.w, brick.h)
+        return None
+
+    def forget_spawn(self, spawn_id):
+        if spawn_id is None or not 0 <= spawn_id < len(self.spawns):
+            return None  # a fireball, or a sprite of a chunked level
+        kind, x, y, w, h = self.spawns[spawn_id]
+        self.spawns[spawn_id] = None
+        return kind, levels.make_entry(kind, x, y, w, h)
+
+    def all_batches(self):
+        if self.fireballs is None:
+            return self.batches
+        return self.batches + [self.fireballs]
+
+    def entity_count(self):
+        sleeping = sum(len(column) for column in self.sleeping.values())
+        sleeping += sum(len(column) for column in self.unloaded.values())
+        return (len(self.sprites) + sleeping
+                + sum(len(b) for b in self.all_batches() + self.dormant_batches()))
+
+    def state_hash(self):
+        # CRC of where every entity is, awake or asleep, to spot a replay
+        # drifting from its recording. Only comparable within one backend.
+        sleeping = [sprite for column in self.sleeping.values() for sprite, tick in column.values()]
+        entries = [(s.order, s.tag, s.x, s.y, s.w, s.h) for s in list(self.sprites.values()) + sleeping]
+        # Unloaded spawns count as the sprites they will be
+        entries += [(order, self.SPAWNS[kind][0].tag, x, y, w, h) for column in self.unloaded.values()
+                    for order, (kind, x, y, w, h) in column.items()]
+        crc = 0
+        for order, tag, x, y, w, h in sorted(entries):
+            crc = zlib.crc32(struct.pack("<idddd", tag, x, y, w, h), crc)
+        for batch in self.all_batches() + self.dormant_batches():
+            for name in ("x", "y", "w", "h", "seq"):
+                crc = zlib.crc32(getattr(batch, name).tobytes(), crc)
+        return crc
+
     def fireball(self):
-        self.sprites.append(Fireball(self.luigi.x, self.luigi.y, 15, 15, "images/fireball.png"))
+        if self.fireballs is not None:
+            self.fireballs.append(self.luigi.x, self.luigi.y, 15, 15, seq=self.take_orders(1)[0])
+        else:
+            self.add_sprite(Fireball(self.luigi.x, self.luigi.y, 15, 15, "images/fireball.png"))
         
-    def remove_sprite(self, ind):
-        if 0 <= ind < len(self.sprites):
-            self.sprites.pop(ind)
+    def despawn(self, sprite):
+        # Leaving the grid takes the sprite out of every later collision
+        # test right away; it leaves self.sprites in flush_despawned
+        if sprite in self.grid:
+            self.grid.remove(sprite)
+            self.despawned.append(sprite)
+
+    def flush_despawned(self, consumed=True):
+        # consumed is False for sprites streamed out with their chunk, which
+        # spawn again when it loads
+        for sprite in self.despawned:
+            del self.sprites[sprite.order]
+            self.live_spawns.discard(sprite.spawn_id)
+            if consumed and sprite.spawn_id is not None:
+                self.consumed.add(sprite.spawn_id)
+        self.removed += len(self.despawned)
+        self.despawned.clear()
+
+    def compact(self, batch, consumed=True):
+        # The numpy counterpart of flush_despawned
+        before = len(batch)
+        dropped = batch.compact()
+        self.live_spawns.difference_update(dropped)
+        if consumed:
+            self.consumed.update(dropped)
+        self.removed += before - len(batch)
 
 class View:
-    def __init__(self, model):
+    def __init__(self, model, static_layer=True):
         self.model = model
-        self.canvas = pygame.display.set_mode((1000, 500))
+        self.canvas = pygame.display.get_surface() or pygame.display.set_mode((1000, 500))
         pygame.display.set_caption("Lugi's final resting place, python")
         self.scroll_x = 0
+        self.drawn = 0
+        self.culled = 0
+        # With a static layer the bricks are baked into background chunks and
+        # only the rects that changed are sent to the display
+        self.static_layer = None
+        if static_layer:
+            self.static_layer = StaticLayer(model.tiles, self.canvas.get_height())
+        self.last_scroll_x = None
+        self.last_rects = []
+        self.bricks_drawn = 0  # bricks on screen, counted when the layered path scrolls
+        model.tile_listeners.append(self.tiles_changed)
+        self.editMode = False
+        self.show_profile = False
+        self.profile_font = None
+        self.edit_font = None
+        # Frames can fall between ticks: draw_x is the scroll position drawn
+        # and lag how far back towards the state remembered before the last
+        # tick everything is drawn, 0 for the latest state
+        self.draw_x = 0
+        self.lag = 0.0
+        self.previous = None
+        self.previous_batches = {}
+        self.previous_scroll_x = 0
     
     def set_edit_info(self, editMode, addMapItem, removeMapItem, current_item):
         self.editMode = editMode
         self.addMapItem = addMapItem
         self.removeMapItem = removeMapItem
         self.current_item = current_item
+
+    def tiles_changed(self, x, w):
+        # The model swapped in new bricks over [x, x + w)
+        if self.static_layer is not None:
+            self.static_layer.tiles = self.model.tiles
+            self.static_layer.invalidate(x, w)
+            self.last_scroll_x = None
         
-    def update(self):
+    def remember(self):
+        # Called before each tick to keep where everything near the window
+        # is, above and below it too, for update() to draw from
+        w, h = self.canvas.get_size()
+        sprites = self.model.sprites_in(self.scroll_x - 100, -100, w + 200, h + 200)
+        self.previous = {sprite.order: (sprite.x, sprite.y) for sprite in sprites}
+        self.previous_batches = {batch: (batch.seq.copy(), batch.x.copy(), batch.y.copy())
+                                 for batch in self.model.all_batches()}
+        self.previous_scroll_x = self.scroll_x
+
+    def update(self, alpha=1.0):
+        # alpha is how far this frame is from the previous tick to the
+        # latest one
+        self.lag = 1.0 - alpha if self.previous is not None else 0.0
+        self.draw_x = self.scroll_x - (self.scroll_x - self.previous_scroll_x) * self.lag
+        if self.static_layer is not None:
+            self.update_layered()
+            return
+
         # Clear the screen
         self.canvas.fill((135, 206, 235))  # Sky blue background
         
         # Draw ground
         pygame.draw.rect(self.canvas, (0, 128, 0), (0, 475, 1000, 25))
         
-        # Draw all sprites
-        for sprite in self.model.sprites:
-            sprite.draw(self.canvas, self.scroll_x)
+        # Draw only the sprites inside the visible window
+        w, h = self.canvas.get_size()
+        bricks = self.model.tiles.overlapping(self.draw_x, 0, w, h)
+        sprites = self.model.sprites_in(self.draw_x, 0, w, h)
+        self.canvas.blits([brick.blit_args(self.draw_x) for brick in bricks], doreturn=False)
+        rects = self.draw_sprites(sprites)
+        self.drawn = len(bricks) + len(rects)
+        self.culled = len(self.model.tiles) + self.model.entity_count() - self.drawn
+        self.draw_edit_info()
+        self.draw_profile()
+        profiler.count("drawn", self.drawn)
+        profiler.count("culled", self.culled)
+        profiler.mark("draw")
             
         # Update the display
         pygame.display.flip()
-        if self.editMode:
-            color = (0, 255, 0) if self.addMapItem else (255, 0, 0)
-            pygame.draw.rect(self.canvas, color, (0, 0, 100, 100))
-            font = pygame.font.SysFont(None, 24)
-            label = font.render(self.current_item, True, (0, 0, 0))
-            self.canvas.blit(label, (10, 10))
+        profiler.mark("flip")
+
+    def update_layered(self):
+        w, h = self.canvas.get_size()
+        screen = pygame.Rect(0, 0, w, h)
+        if self.draw_x != self.last_scroll_x:
+            # Scrolled: the whole background moved
+            self.static_layer.draw(self.canvas, screen, self.draw_x)
+            dirty = [screen]
+            self.bricks_drawn = len(self.model.tiles.overlapping(self.draw_x, 0, w, h))
+        else:
+            # Only wipe where sprites were drawn last frame
+            for rect in self.last_rects:
+                self.static_layer.draw(self.canvas, rect, self.draw_x)
+            dirty = self.last_rects
+
+        sprites = self.model.sprites_in(self.draw_x, 0, w, h)
+        rects = [rect.clip(screen) for rect in self.draw_sprites(sprites)]
+        # Counted like the immediate path, bricks included
+        self.drawn = self.bricks_drawn + len(rects)
+        self.culled = len(self.model.tiles) + self.model.entity_count() - self.drawn
+        for rect in (self.draw_edit_info(), self.draw_profile()):
+            if rect is not None:
+                rects.append(rect)
+        profiler.count("drawn", self.drawn)
+        profiler.count("culled", self.culled)
+        profiler.mark("draw")
+
+        if dirty is not self.last_rects or len(dirty) + len(rects) > 64:
+            pygame.display.update(screen)
+        else:
+            pygame.display.update(dirty + rects)
+        profiler.mark("flip")
+        self.last_scroll_x = self.draw_x
+        self.last_rects = rects
+
+    def draw_sprites(self, sprites):
+        # Batches first, then the Sprite objects, then fireballs on top, the
+        # order they load in. Returns the screen rect of everything drawn.
+        w, h = self.canvas.get_size()
+        lag = self.lag
+        rects = []
+        for batch in self.model.batches:
+            rects += batch.draw(self.canvas, self.draw_x, w, h, self.previous_batches.get(batch), lag)
+        blits = []
+        for sprite in sprites:
+            sheet, (x, y), area = sprite.blit_args(self.draw_x)
+            if lag and sprite.order in self.previous:
+                px, py = self.previous[sprite.order]
+                x -= (sprite.x - px) * lag
+                y -= (sprite.y - py) * lag
+            blits.append((sheet, (x, y), area))
+            # One pixel of slack covers blit positions truncated from floats
+            rects.append(pygame.Rect(int(x) - 1, int(y) - 1, sprite.w + 2, sprite.h + 2))
+        self.canvas.blits(blits, doreturn=False)
+        if self.model.fireballs is not None:
+            fireballs = self.model.fireballs
+            rects += fireballs.draw(self.canvas, self.draw_x, w, h, self.previous_batches.get(fireballs), lag)
+        return rects
+
+    def draw_edit_info(self):
+        if not self.editMode:
+            return None
+        color = (0, 255, 0) if self.addMapItem else (255, 0, 0)
+        rect = pygame.draw.rect(self.canvas, color, (0, 0, 100, 100))
+        if self.edit_font is None:
+            self.edit_font = pygame.font.SysFont(None, 24)
+        label = self.edit_font.render(self.current_item, True, (0, 0, 0))
+        self.canvas.blit(label, (10, 10))
+        return rect
+
+    def draw_profile(self):
+        # Averages over the last second of frames, top right of the screen
+        if not self.show_profile or not profiler.frames:
+            return None
+        if self.profile_font is None:
+            self.profile_font = pygame.font.Font(None, 20)
+        avg = profiler.average(30)
+        lines = ["frame %.2f ms" % (avg["total"] * 1000)]
+        lines += ["%s %.2f ms" % (phase, avg[phase] * 1000) for phase in Profiler.PHASES]
+        lines += ["%s %.0f" % (name, avg[name]) for name in Profiler.COUNTERS]
+        x = self.canvas.get_width() - 170
+        rect = pygame.Rect(x, 0, 170, 16 * len(lines) + 8)
+        self.canvas.fill((0, 0, 0), rect)
+        for i, line in enumerate(lines):
+            self.canvas.blit(self.profile_font.render(line, True, (255, 255, 255)), (x + 6, 4 + 16 * i))
+        return rect
         
     def set_scroll_x(self, i):
         self.scroll_x = max(0, i)  # Prevent negative scrolling
+        self.model.set_viewport(self.scroll_x, self.canvas.get_width())
+
+class HeadlessView:
+    # Stands in for View when there is no display: it keeps the scroll
+    # position the controller sets but draws nothing.
+    def __init__(self, model):
+        self.model = model
+        self.scroll_x = 0
+
+    def set_edit_info(self, editMode, addMapItem, removeMapItem, current_item):
+        pass
+
+    def remember(self):
+        pass
+
+    def update(self, alpha=1.0):
+        pass
+
+    def set_scroll_x(self, i):
+        self.scroll_x = max(0, i)
+        self.model.set_viewport(self.scroll_x, 1000)
+
+class Editor:
+    # Turns edit mode clicks into Model.add_item and Model.remove_at calls
+    # and logs each edit to the level's EditLog, which folds them into the
+    # level file in the background every compact_every edits and when the
+    # editor closes. Open the EditLog before loading the Model: it folds in
+    # edits an earlier session left behind. Every Model call is also kept
+    # in changes, in Simulation.tick's edits form, for the input log.
+    ITEMS = {"brick": ("bricks", 50, 50), "mushroom": ("mushrooms", 20, 20),
+             "goomba": ("goombas", 25, 25), "drybones": ("drybones", 40, 50),
+             "fireball": ("fireballs", 15, 15)}
+
+    def __init__(self, model, log, compact_every=100):
+        self.model = model
+        self.log = log
+        self.compact_every = compact_every
+        # Boxes of the live spawns, so the same item is not added twice on
+        # one spot; counted on the first add
+        self.taken = None
+        self.changes = []
+
+    def add(self, item, x, y):
+        kind, w, h = self.ITEMS[item]
+        if kind == "bricks":
+            x, y = x // w * w, y // h * h  # bricks snap to the tile grid
+        else:
+            x, y = x - w // 2, y - h // 2
+        key = (kind, x, y, w, h)
+        if kind in ("mushrooms", "goombas", "drybones"):
+            if self.taken is None:
+                self.taken = Counter(spawn for spawn in self.model.spawns if spawn is not None)
+            if self.taken[key]:
+                return None
+            self.taken[key] += 1
+        entry = self.model.add_item(kind, x, y, w, h)
+        self.changes.append(("add", kind, x, y, w, h))
+        if entry is not None:
+            self.logged("add", kind, entry)
+        return entry
+
+    def remove(self, x, y):
+        removed = self.model.remove_at(x, y)
+        self.changes.append(("remove", x, y))
+        if removed is not None:
+            kind, entry = removed
+            if self.taken is not None and kind != "bricks":
+                self.taken[(kind,) + levels.entry_box(entry)] -= 1
+            self.logged("remove", kind, entry)
+        return removed
+
+    def logged(self, op, kind, entry):
+        self.log.append(op, kind, entry)
+        if self.log.pending >= self.compact_every:
+            self.log.compact()
+
+    def save(self):
+        self.log.compact()
+
+    def close(self):
+        self.log.close()
 
 class Controller:
-    def __init__(self, model, view):
+    def __init__(self, model, view, editor=None):
         self.model = model
         self.view = view
+        self.editor = editor
         self.key_right = False
         self.key_left = False
         self.key_up = False
@@ -496,6 +2225,9 @@ class Controller:
         self.removeMapItem = False
         self.current_item = ["brick", "mushroom", "goomba", "drybones", "fireball"]
         self.current_item_index = 0
+        self.pressed = set()  # "edit" presses since input_keys()
+        self.fires = 0  # fireball presses since input_keys(), thrown on the next tick
+        self.clicks = []  # edit mode clicks for the next tick, see apply_clicks
         
     def handle_events(self):
         for event in pygame.event.get():
@@ -512,26 +2244,36 @@ class Controller:
                 elif event.key == K_SPACE or event.key == K_UP:
                     self.key_up = True
                 elif event.key == K_DOWN:
-                    self.model.fireball()
+                    self.fires += 1
+                elif event.key == K_F3:
+                    # Toggle the profiling overlay
+                    self.view.show_profile = not self.view.show_profile
+                    profiler.enabled = profiler.keep or self.view.show_profile
                 elif event.key == K_e:
-                    self.editMode = not self.editMode
-                    print("e has been pressed.")
-                    if(self.editMode):
-                        addMapItem = True
-                        removeMapItem = False
-                    else:
-                        addMapItem = False
-                        removeMapItem = False
-                    if event.key == K_a:
-                        print("a has been pressed.")
-                        if self.editMode:
-                            self.addMapItem = True
-                            self.removeMapItem = False
-                    if event.key == K_r:
-                        print("r has been pressed.")
-                        if self.editMode:
-                            self.addMapItem = False
-                            self.removeMapItem = True                 
+                    self.toggle_edit()
+                    self.pressed.add("edit")
+                    log.debug("e has been pressed.")
+                elif event.key == K_a and self.editMode:
+                    log.debug("a has been pressed.")
+                    self.addMapItem = True
+                    self.removeMapItem = False
+                elif event.key == K_r and self.editMode:
+                    log.debug("r has been pressed.")
+                    self.addMapItem = False
+                    self.removeMapItem = True
+                elif event.key == K_TAB and self.editMode:
+                    # Next item to place
+                    self.current_item_index = (self.current_item_index + 1) % len(self.current_item)
+                elif event.key == K_s and self.editMode and self.editor is not None:
+                    self.editor.save()
+            elif event.type == MOUSEBUTTONDOWN and event.button == 1:
+                if self.editMode and self.editor is not None:
+                    x = int(event.pos[0] + self.view.scroll_x)
+                    y = event.pos[1]
+                    if self.addMapItem:
+                        self.clicks.append((self.current_item[self.current_item_index], x, y))
+                    elif self.removeMapItem:
+                        self.clicks.append((None, x, y))
             elif event.type == KEYUP:
                 if event.key == K_RIGHT:
                     self.key_right = False
@@ -555,18 +2297,231 @@ class Controller:
             self.model.luigi.jump()
         self.view.set_edit_info(self.editMode, self.addMapItem, self.removeMapItem, self.current_item[self.current_item_index])
 
+    def apply_input(self, keys, fires=None):
+        # Scripted stand-in for handle_events: keys holds the actions for
+        # this tick, "right", "left" and "up" while held, "fire" and "edit"
+        # on the tick they are pressed. fires counts the fireballs when
+        # "fire" was pressed more than once.
+        self.key_right = "right" in keys
+        self.key_left = "left" in keys
+        self.key_up = "up" in keys
+        if fires is None:
+            fires = 1 if "fire" in keys else 0
+        self.throw(fires)
+        if "edit" in keys:
+            self.toggle_edit()
+
+    def throw(self, fires):
+        for _ in range(fires):
+            self.model.fireball()
+
+    def apply_clicks(self):
+        # Make the edits clicked since the last tick. They wait for the
+        # tick so they always come after its fireballs, as on replay.
+        # Returns the Model changes they made.
+        if self.editor is None:
+            return []
+        for item, x, y in self.clicks:
+            if item is None:
+                self.editor.remove(x, y)
+            else:
+                self.editor.add(item, x, y)
+        self.clicks = []
+        changes = self.editor.changes
+        self.editor.changes = []
+        return changes
+
+    def toggle_edit(self):
+        # Edit mode starts out adding items
+        self.editMode = not self.editMode
+        self.addMapItem = self.editMode
+        self.removeMapItem = False
+
+    def input_keys(self):
+        # The input handle_events saw since the last tick, in apply_input's
+        # form: the keys and the fireball count
+        keys, fires = self.pressed, self.fires
+        self.pressed = set()
+        self.fires = 0
+        for key, held in (("right", self.key_right), ("left", self.key_left), ("up", self.key_up)):
+            if held:
+                keys.add(key)
+        if fires:
+            keys.add("fire")
+        return keys, fires
+
+class Simulation:
+    # Runs the game loop without a display or frame limiter, feeding the
+    # controller from a per-tick input script instead of pygame events.
+    # edits maps ticks to the editor's Model changes, ("add", kind, x, y,
+    # w, h) and ("remove", x, y), made after that tick's input.
+    def __init__(self, map_file="map.json", inputs=(), backend="objects", edits=None, fires=None):
+        self.model = Model(map_file, backend)
+        self.view = HeadlessView(self.model)
+        self.controller = Controller(self.model, self.view)
+        self.inputs = iter(inputs)
+        self.edits = edits or {}
+        self.fires = fires or {}  # fireball counts of the ticks with several
+        self.ticks = 0
+
+    def tick(self, keys=None):
+        if keys is None:
+            keys = next(self.inputs, ())
+        profiler.begin()
+        self.controller.apply_input(keys, self.fires.get(self.ticks))
+        for edit in self.edits.get(self.ticks, ()):
+            if edit[0] == "add":
+                self.model.add_item(*edit[1:])
+            else:
+                self.model.remove_at(*edit[1:])
+        self.controller.update()
+        profiler.mark("controller")
+        self.model.update()
+        profiler.end()
+        self.ticks += 1
+
+    def run(self, ticks):
+        # Once the script runs out every further tick gets no input
+        for _ in range(ticks):
+            self.tick()
+        return self
+
+def replay(path, check=False):
+    # Play an input log back headlessly as fast as possible. Returns the
+    # simulation and, with check, the first tick whose state hash differs
+    # from the recording (None if they all match).
+    settings, inputs, hashes, edits, fires = inputlog.read(path)
+    sim = Simulation(settings["map"], inputs, settings["backend"], edits, fires)
+    sim.model.sleep_margin = settings["sleep_margin"]
+    sim.model.catch_up = settings["catch_up"]
+    if not check or hashes is None:
+        return sim.run(len(inputs)), None
+    for tick, expected in enumerate(hashes):
+        sim.tick()
+        if sim.model.state_hash() != expected:
+            return sim, tick
+    return sim, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--map", default="map.json",
+                        help="level to play: map.json-style, binary or chunked (see levels.py); "
+                             "chunked levels cannot be edited")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="record per-frame timings and write the last frames to FILE (.csv or .json)")
+    parser.add_argument("--log-level", default="WARNING", help="e.g. DEBUG to see collision messages")
+    parser.add_argument("--sleep-margin", type=int, default=1000,
+                        help="px outside the window past which enemies sleep, -1 to keep them all awake")
+    parser.add_argument("--record", metavar="FILE", help="write this session's input to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back an input log headlessly instead")
+    parser.add_argument("--check", action="store_true",
+                        help="with --replay, compare the state after every tick with the recording")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print how long each step up to the first frame took")
+    parser.add_argument("--fps", type=int, default=60,
+                        help="frames drawn per second, 0 for as many as possible; the game itself "
+                             "always runs at %d ticks per second" % TICKS_PER_SECOND)
+    args = parser.parse_args(argv)
+    set_log_level(args.log_level.upper())
+    profiler.keep = profiler.enabled = args.profile is not None
+
+    if args.replay:
+        start = time.perf_counter()
+        sim, diverged = replay(args.replay, args.check)
+        elapsed = time.perf_counter() - start
+        print("Replayed %d ticks in %.2fs (%.0f ticks/s)" % (sim.ticks, elapsed, sim.ticks / elapsed))
+        if args.profile:
+            profiler.export(args.profile)
+        if diverged is not None:
+            print("State differs from the recording at tick", diverged)
+            raise SystemExit(1)
+        if args.check:
+            print("State matches the recording")
+        raise SystemExit(0)
+
+    print("Use the arrow keys to move. Press Esc to quit.")
+    startup = StartupProfile()
+    pygame.init()
+    startup.mark("pygame.init")
+    # Open the window before loading so the images get converted to its format
+    pygame.display.set_mode((1000, 500))
+    startup.mark("display")
+    assets.load_atlas("images")
+    startup.mark("images")
+    # Only the spawns around the first screen load before the first frame;
+    # the rest load in the frames' spare time or when they wake up
+    editable = not levels.is_chunked(args.map)
+    edit_log = levels.EditLog(args.map) if editable else None
+    m = Model(args.map, lazy=True)
+    if args.sleep_margin >= 0:
+        m.sleep_margin = args.sleep_margin
+    startup.mark("level")
+    v = View(m)
+    startup.mark("view")
+    editor = Editor(m, edit_log) if editable else None
+    c = Controller(m, v, editor)
+    startup.mark("editor")
+    clock = pygame.time.Clock()
+    step = 1.0 / TICKS_PER_SECOND
+    behind = 0.0  # real time not yet simulated
+    last = time.perf_counter()
+    recorder = None
+    if args.record:
+        # The editor rewrites the level, so the log replays on a copy of it
+        # as this session loaded it
+        level = args.map
+        if editable:
+            level = args.record + ".level"
+            shutil.copyfile(args.map, level)
+        recorder = inputlog.InputWriter(args.record, {"map": level, "backend": m.backend,
+                                                      "sleep_margin": m.sleep_margin, "catch_up": m.catch_up})
+
+    while c.keep_going:
+        profiler.begin()
+        now = time.perf_counter()
+        behind += now - last
+        last = now
+        c.handle_events()
+        profiler.mark("events")
+        # Run as many fixed ticks as real time calls for, then draw the
+        # frame part way between the last two of them
+        ticks = 0
+        while behind >= step and ticks < MAX_FRAME_TICKS:
+            v.remember()
+            keys, fires = c.input_keys()
+            c.throw(fires)
+            edits = c.apply_clicks()
+            c.update()
+            profiler.mark("controller")
+            m.update()
+            if recorder is not None:
+                recorder.write(keys, m.state_hash(), edits, fires)
+            behind -= step
+            ticks += 1
+        if ticks == MAX_FRAME_TICKS:
+            behind = min(behind, step)
+        profiler.count("ticks", ticks)
+        v.update(behind / step)
+        profiler.end()
+        if startup is not None:
+            startup.mark("first frame")
+            print(assets.report())
+            if args.startup_profile:
+                print(startup.report())
+            startup = None
+        if m.unloaded:
+            m.load_unloaded(LOAD_BUDGET)
+        clock.tick(args.fps)
+    if editor is not None:
+        editor.close()
+    if recorder is not None:
+        recorder.close()
+        print("Recorded %d ticks to %s" % (recorder.ticks, args.record))
+    if args.profile:
+        profiler.export(args.profile)
+    print("Goodbye")
+
 
-print("Use the arrow keys to move. Press Esc to quit.")
-pygame.init()
-m = Model()
-v = View(m)
-c = Controller(m, v)
-clock = pygame.time.Clock()
-
-while c.keep_going:
-    c.handle_events()
-    c.update()
-    m.update()
-    v.update()
-    clock.tick(30)
-print("Goodbye")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import struct
+
+import levels
+
+# Input log format: this magic line, one JSON header line holding the
+# settings the session ran with, then one record per tick: a byte of KEYS
+# bits, followed by the little-endian uint32 state hash after that tick
+# when the header's "hashes" is set. The "fire" bit stands for one
+# fireball; with the FIRES bit a uint16 count of the tick's fireballs
+# follows instead. When the byte has the EDITED bit, a uint16 count and
+# that many EDIT records follow: the editor's changes to the model that
+# tick, made after the tick's fireballs. Older versions have none of
+# these and are still read.
+MAGIC = b"INPUTLOG3\n"
+OLD_MAGICS = (b"INPUTLOG1\n", b"INPUTLOG2\n")
+KEYS = ("right", "left", "up", "fire", "edit")
+RECORD = struct.Struct("<BI")
+FIRES = 0x40
+EDITED = 0x80
+COUNT = struct.Struct("<H")
+# op, index into levels.KINDS, x, y, w, h; a remove only uses x and y
+EDIT = struct.Struct("<BBiiii")
+OPS = ("add", "remove")
+
+# Every byte's key set, so reading a log is one lookup per tick
+DECODE = [frozenset(key for bit, key in enumerate(KEYS) if n & (1 << bit)) for n in range(1 << len(KEYS))]
+
+
+def is_log(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) in (MAGIC,) + OLD_MAGICS
+
+
+def encode(keys):
+    bits = 0
+    for bit, key in enumerate(KEYS):
+        if key in keys:
+            bits |= 1 << bit
+    return bits
+
+
+class InputWriter:
+    def __init__(self, path, settings, hashes=True):
+        self.hashes = hashes
+        self.ticks = 0
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        header = dict(settings, hashes=hashes)
+        self.file.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+
+    def write(self, keys, state_hash=None, edits=(), fires=None):
+        # fires counts the tick's fireballs, by default one if "fire" is in
+        # keys; edits holds ("add", kind, x, y, w, h) and ("remove", x, y)
+        # tuples
+        bits = encode(keys) & ~(1 << KEYS.index("fire"))
+        if fires is None:
+            fires = 1 if "fire" in keys else 0
+        if fires == 1:
+            bits |= 1 << KEYS.index("fire")
+        elif fires:
+            bits |= FIRES
+        if edits:
+            bits |= EDITED
+        if self.hashes:
+            self.file.write(RECORD.pack(bits, state_hash))
+        else:
+            self.file.write(bytes((bits,)))
+        if fires > 1:
+            self.file.write(COUNT.pack(fires))
+        if edits:
+            self.file.write(COUNT.pack(len(edits)))
+            for edit in edits:
+                if edit[0] == "add":
+                    op, kind, x, y, w, h = edit
+                    self.file.write(EDIT.pack(0, levels.KINDS.index(kind), x, y, w, h))
+                else:
+                    op, x, y = edit
+                    self.file.write(EDIT.pack(1, 0, x, y, 0, 0))
+        self.ticks += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read(path):
+    # The header settings, the key set of every tick, the state hashes
+    # (None when the log was written without them), the edits as
+    # {tick: [edit, ...]} in InputWriter.write's form and the fireball
+    # counts of the ticks with more than one, as {tick: count}. Those
+    # ticks have "fire" among their keys.
+    with open(path, "rb") as file:
+        magic = file.read(len(MAGIC))
+        if magic not in (MAGIC,) + OLD_MAGICS:
+            raise ValueError("%s is not an input log" % path)
+        settings = json.loads(file.readline())
+        body = file.read()
+    hashes = settings.pop("hashes")
+    # Until the first tick with extras the records all have the same size,
+    # so stepping by it finds that tick's key byte if there is one
+    if max(body[::RECORD.size if hashes else 1], default=0) < FIRES:
+        if not hashes:
+            return settings, [DECODE[bits] for bits in body], None, {}, {}
+        if len(body) % RECORD.size:
+            raise ValueError("%s ends in the middle of a tick" % path)
+        records = list(RECORD.iter_unpack(body))
+        return settings, [DECODE[bits] for bits, h in records], [h for bits, h in records], {}, {}
+    inputs = []
+    state_hashes = [] if hashes else None
+    edits = {}
+    fires = {}
+    at = 0
+    try:
+        while at < len(body):
+            bits = body[at]
+            if hashes:
+                state_hashes.append(RECORD.unpack_from(body, at)[1])
+                at += RECORD.size
+            else:
+                at += 1
+            if bits & FIRES:
+                fires[len(inputs)], = COUNT.unpack_from(body, at)
+                at += COUNT.size
+                bits |= 1 << KEYS.index("fire")
+            if bits & EDITED:
+                count, = COUNT.unpack_from(body, at)
+                at += COUNT.size
+                tick = edits[len(inputs)] = []
+                for _ in range(count):
+                    op, kind, x, y, w, h = EDIT.unpack_from(body, at)
+                    at += EDIT.size
+                    if OPS[op] == "add":
+                        tick.append(("add", levels.KINDS[kind], x, y, w, h))
+                    else:
+                        tick.append(("remove", x, y))
+            inputs.append(DECODE[bits & ~(FIRES | EDITED)])
+    except struct.error:
+        raise ValueError("%s ends in the middle of a tick" % path)
+    return settings, inputs, state_hashes, edits, fires
+
+
+def show(args):
+    settings, inputs, hashes, edits, fires = read(args.log)
+    print("settings:", json.dumps(settings))
+    print("%d ticks, %s" % (len(inputs), "with state hashes" if hashes is not None else "no state hashes"))
+    for key in KEYS:
+        print("  %-5s %d ticks" % (key, sum(key in keys for keys in inputs)))
+    print("%d fireballs" % sum(fires.get(tick, "fire" in keys) for tick, keys in enumerate(inputs)))
+    print("%d editor changes on %d ticks" % (sum(map(len, edits.values())), len(edits)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Describe a recorded input log.")
+    parser.add_argument("log")
+    show(parser.parse_args())
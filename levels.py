@@ -0,0 +1,386 @@
+import argparse
+import json
+import mmap
+import multiprocessing
+import operator
+import os
+import struct
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:  # binary levels fall back to struct without it
+    np = None
+
+# Entry lists of the map.json schema, in the order the file uses them
+KINDS = ("bricks", "mushrooms", "goombas", "drybones", "fireballs")
+
+# Chunked level format: this magic line, one JSON header line holding the
+# chunk index, then one JSON line per chunk. A chunk is a map.json-style
+# object with the entries whose x falls in [index * chunk_width,
+# (index + 1) * chunk_width); header offsets count from the first chunk.
+CHUNK_MAGIC = b"LEVELCHUNKS1\n"
+
+
+# Binary level format: this magic, one little-endian uint32 count per kind
+# (in KINDS order), then each kind's fixed-width records back to back.
+# Every record holds int32 x, y, w, h and a flags byte; goombas add an int32
+# fireCounter. A set FLAG_TYPE means the entry had its "type" key.
+BINARY_MAGIC = b"LEVELBIN1\n"
+FLAG_TYPE = 1
+TYPE_NAMES = {"mushrooms": "mushroom", "goombas": "goomba", "drybones": "drybones", "fireballs": "fireball"}
+RECORD_FIELDS = {kind: ["x", "y", "w", "h", "flags"] for kind in KINDS}
+RECORD_FIELDS["goombas"] = ["x", "y", "w", "h", "flags", "fireCounter"]
+RECORD_FORMATS = {kind: "<iiiiB" for kind in KINDS}
+RECORD_FORMATS["goombas"] = "<iiiiBi"
+
+
+def is_chunked(path):
+    with open(path, "rb") as file:
+        return file.read(len(CHUNK_MAGIC)) == CHUNK_MAGIC
+
+
+def is_binary(path):
+    with open(path, "rb") as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def record_dtype(kind):
+    return np.dtype([(name, "<i4" if name != "flags" else "u1") for name in RECORD_FIELDS[kind]])
+
+
+def write_binary(data, path):
+    # Refuses entries it could not give back unchanged
+    header = [BINARY_MAGIC]
+    bodies = []
+    for kind in KINDS:
+        entries = data.get(kind, [])
+        header.append(struct.pack("<I", len(entries)))
+        pack = struct.Struct(RECORD_FORMATS[kind]).pack
+        fields = RECORD_FIELDS[kind]
+        for entry in entries:
+            flags = 0
+            if "type" in entry:
+                if entry["type"] != TYPE_NAMES.get(kind):
+                    raise ValueError("%s entry has type %r" % (kind, entry["type"]))
+                flags |= FLAG_TYPE
+            extra = set(entry) - set(fields) - {"type"}
+            if extra or (kind == "goombas") != ("fireCounter" in entry):
+                raise ValueError("%s entry %r does not fit a binary record" % (kind, entry))
+            values = [entry[name] for name in fields if name != "flags"]
+            if any(type(v) is not int for v in values):
+                raise ValueError("%s entry %r has non-integer values" % (kind, entry))
+            values.insert(4, flags)
+            bodies.append(pack(*values))
+    with open(path, "wb") as file:
+        file.writelines(header)
+        file.writelines(bodies)
+
+
+def read_binary(path):
+    # Maps the file and returns the records of each kind without decoding
+    # them one by one: numpy structured arrays viewing the mapping, or
+    # lists of tuples when numpy is missing
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError("%s is not a binary level" % path)
+    offset = len(BINARY_MAGIC)
+    counts = struct.unpack_from("<%dI" % len(KINDS), buffer, offset)
+    offset += 4 * len(KINDS)
+    data = {}
+    for kind, count in zip(KINDS, counts):
+        size = struct.calcsize(RECORD_FORMATS[kind])
+        if np is not None:
+            data[kind] = np.frombuffer(buffer, record_dtype(kind), count, offset)
+        else:
+            data[kind] = list(struct.iter_unpack(RECORD_FORMATS[kind], buffer[offset:offset + size * count]))
+        offset += size * count
+    return data
+
+
+def records_to_entries(kind, records):
+    # Binary records back to map.json entries
+    fields = RECORD_FIELDS[kind]
+    entries = []
+    for record in (records.tolist() if np is not None else records):
+        entry = {name: value for name, value in zip(fields, record) if name != "flags"}
+        if record[4] & FLAG_TYPE:
+            entry["type"] = TYPE_NAMES[kind]
+        entries.append(entry)
+    return entries
+
+
+def boxes(entries):
+    # x, y, w and h columns as lists, for map.json entries or binary records
+    if np is not None and isinstance(entries, np.ndarray):
+        return [entries[name].tolist() for name in ("x", "y", "w", "h")]
+    if entries and isinstance(entries[0], tuple):
+        return [list(column) for column in zip(*entries)][:4]
+    return [[e[name] for e in entries] for name in ("x", "y", "w", "h")]
+
+
+def make_entry(kind, x, y, w, h):
+    # A new map.json entry, shaped like the ones the game ships with
+    entry = {"x": x, "y": y, "w": w, "h": h}
+    if kind == "goombas":
+        entry["fireCounter"] = 0
+    if kind in TYPE_NAMES:
+        entry["type"] = TYPE_NAMES[kind]
+    return entry
+
+
+def level_width(data):
+    # Right edge of the rightmost entry, of map.json entries or binary records
+    width = 0
+    for kind in KINDS:
+        x, y, w, h = boxes(data.get(kind, []))
+        width = max(width, max(map(operator.add, x, w), default=0))
+    return width
+
+
+def write_chunked(data, path, chunk_width=1000):
+    chunks = {}
+    for kind in KINDS:
+        for entry in data.get(kind, []):
+            index = int(entry["x"] // chunk_width)
+            if index not in chunks:
+                chunks[index] = {k: [] for k in KINDS}
+            chunks[index][kind].append(entry)
+    header = {"chunk_width": chunk_width, "width": level_width(data), "chunks": []}
+    bodies = []
+    offset = 0
+    for index in sorted(chunks):
+        body = json.dumps(chunks[index], separators=(",", ":")).encode() + b"\n"
+        header["chunks"].append({"index": index, "offset": offset, "length": len(body)})
+        bodies.append(body)
+        offset += len(body)
+    with open(path, "wb") as file:
+        file.write(CHUNK_MAGIC)
+        file.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+        file.writelines(bodies)
+
+
+class ChunkedLevel:
+    # Reads the header of a chunked level up front and single chunks on
+    # demand, so opening a level costs the same however long it is
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(len(CHUNK_MAGIC)) != CHUNK_MAGIC:
+            self.file.close()
+            raise ValueError("%s is not a chunked level" % path)
+        header = json.loads(self.file.readline())
+        self.chunk_width = header["chunk_width"]
+        self.width = header["width"]
+        self.index = {c["index"]: (c["offset"], c["length"]) for c in header["chunks"]}
+        self.body_start = self.file.tell()
+
+    def read(self, index):
+        # Entries of one chunk, or None for an empty stretch of the level
+        if index not in self.index:
+            return None
+        offset, length = self.index[index]
+        self.file.seek(self.body_start + offset)
+        return json.loads(self.file.read(length))
+
+    def read_all(self):
+        data = {k: [] for k in KINDS}
+        for index in sorted(self.index):
+            chunk = self.read(index)
+            for kind in KINDS:
+                data[kind].extend(chunk.get(kind, []))
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+# Edit logs: the editor appends one JSON line per edit to <level>.edits,
+# {"op": "add" or "remove", "kind": one of KINDS, "entry": {...}}. To
+# compact, EditLog renames the log to <level>.compacting and compact_edits
+# folds that into the level file. Entries are matched by their box: an add
+# is skipped when the box is already there and a remove when it is gone,
+# so a log folded in twice (a crash between replacing the level and
+# deleting the log) changes nothing more.
+EDITS = ".edits"
+COMPACTING = ".compacting"
+
+
+def entry_box(entry):
+    return entry["x"], entry["y"], entry["w"], entry["h"]
+
+
+def apply_edits(data, edits):
+    # Fold edits into map.json-style data, one pass over each kind touched
+    for kind in KINDS:
+        ops = [edit for edit in edits if edit["kind"] == kind]
+        if not ops:
+            continue
+        entries = data.get(kind, [])
+        count = Counter(entry_box(entry) for entry in entries)
+        added = {}  # box -> entry added by this log
+        dropped = Counter()  # boxes to drop from the existing entries
+        for op in ops:
+            box = entry_box(op["entry"])
+            if op["op"] == "add":
+                if not count[box]:
+                    count[box] += 1
+                    added[box] = op["entry"]
+            elif count[box]:
+                count[box] -= 1
+                if added.pop(box, None) is None:
+                    dropped[box] += 1
+        kept = []
+        for entry in entries:
+            box = entry_box(entry)
+            if dropped[box]:
+                dropped[box] -= 1
+            else:
+                kept.append(entry)
+        data[kind] = kept + list(added.values())
+
+
+def read_edits(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def compact_edits(path):
+    # Fold <path>.compacting into the level file, which is replaced
+    # atomically, then delete the log
+    segment = path + COMPACTING
+    if not os.path.exists(segment):
+        return
+    if is_chunked(path):
+        raise ValueError("%s is a chunked level, which cannot be edited" % path)
+    edits = read_edits(segment)
+    binary = is_binary(path)
+    if binary:
+        records = read_binary(path)
+        data = {kind: records_to_entries(kind, records[kind]) for kind in KINDS}
+        del records
+    else:
+        with open(path) as file:
+            data = json.load(file)
+    apply_edits(data, edits)
+    temp = path + ".tmp"
+    if binary:
+        write_binary(data, temp)
+    else:
+        with open(temp, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+    os.replace(temp, path)
+    os.remove(segment)
+
+
+def fold_pending_edits(path):
+    # Bring a level up to date with logs left behind by an editor that
+    # did not get to compact them
+    if os.path.exists(path + COMPACTING):
+        compact_edits(path)
+    if os.path.exists(path + EDITS):
+        os.replace(path + EDITS, path + COMPACTING)
+        compact_edits(path)
+
+
+class EditLog:
+    # Appends edits to <path>.edits as they happen, so they are on disk
+    # straight away, and folds them into the level in a separate process so
+    # rewriting a big level never stalls the game. Only the writer folds:
+    # loading a level never touches the file, so any number of readers can
+    # load it at once.
+    def __init__(self, path):
+        if is_chunked(path):
+            raise ValueError("%s is a chunked level, which cannot be edited; "
+                             "convert it with levels.py from-chunks first" % path)
+        # Edits an earlier session logged but never compacted
+        fold_pending_edits(path)
+        self.path = path
+        self.file = None
+        self.pending = 0  # edits since the last compact
+        self.process = None
+
+    def append(self, op, kind, entry):
+        if self.file is None:
+            self.file = open(self.path + EDITS, "a")
+        self.file.write(json.dumps({"op": op, "kind": kind, "entry": entry}) + "\n")
+        self.file.flush()
+        self.pending += 1
+
+    def compact(self, wait=False):
+        # Start folding the edits so far into the level. Returns False when
+        # the previous compaction is still running (unless waiting for it).
+        if self.process is not None:
+            if self.process.is_alive() and not wait:
+                return False
+            self.process.join()
+            self.process = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        # A compaction that died leaves its log behind; fold it first
+        if os.path.exists(self.path + COMPACTING):
+            compact_edits(self.path)
+        if self.pending:
+            os.replace(self.path + EDITS, self.path + COMPACTING)
+            self.pending = 0
+            if wait:
+                compact_edits(self.path)
+            else:
+                self.process = multiprocessing.Process(target=compact_edits, args=(self.path,))
+                self.process.start()
+        return True
+
+    def close(self):
+        self.compact(wait=True)
+
+
+def to_chunks(args):
+    with open(args.source) as file:
+        data = json.load(file)
+    write_chunked(data, args.target, args.chunk_width)
+
+
+def to_binary(args):
+    with open(args.source) as file:
+        data = json.load(file)
+    write_binary(data, args.target)
+
+
+def from_binary(args):
+    records = read_binary(args.source)
+    data = {kind: records_to_entries(kind, records[kind]) for kind in KINDS}
+    with open(args.target, "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+
+
+def from_chunks(args):
+    level = ChunkedLevel(args.source)
+    data = level.read_all()
+    level.close()
+    with open(args.target, "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between level file formats.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("to-chunks", help="map.json schema -> chunked level")
+    command.add_argument("source")
+    command.add_argument("target")
+    command.add_argument("--chunk-width", type=int, default=1000)
+    command.set_defaults(run=to_chunks)
+    command = commands.add_parser("from-chunks", help="chunked level -> map.json schema")
+    command.add_argument("source")
+    command.add_argument("target")
+    command.set_defaults(run=from_chunks)
+    command = commands.add_parser("to-binary", help="map.json schema -> binary level")
+    command.add_argument("source")
+    command.add_argument("target")
+    command.set_defaults(run=to_binary)
+    command = commands.add_parser("from-binary", help="binary level -> map.json schema")
+    command.add_argument("source")
+    command.add_argument("target")
+    command.set_defaults(run=from_binary)
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,30 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Headless: no window, and the image paths are relative to the repo root
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benchmark
+import levels
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+
+@pytest.fixture(scope="session")
+def generated(tmp_path_factory):
+    # A bigger level than map.json, with every kind of entity in it
+    path = tmp_path_factory.mktemp("levels")
+    data = benchmark.generate_level(1500, 200, 200, 60, seed=1)
+    with open(path / "generated.json", "w") as file:
+        json.dump(data, file)
+    levels.write_chunked(data, str(path / "generated.chunks"))
+    return path
@@ -0,0 +1,48 @@
+import game
+
+TICKS = 400
+NAMES = {"DryBonesBatch": "DryBones", "MushroomBatch": "Mushroom",
+         "GoombaBatch": "Goomba", "FireballBatch": "Fireball"}
+
+
+def script(ticks):
+    # Right with a turn back now and then, jumping and throwing fireballs
+    for t in range(ticks):
+        keys = {"right"} if (t // 60) % 4 != 3 else {"left"}
+        if t % 25 == 0:
+            keys.add("up")
+        if t % 7 == 0:
+            keys.add("fire")
+        yield keys
+
+
+def snapshot(model):
+    # Every entity as (class, x, y, w, h), awake, asleep or not loaded yet
+    sprites = list(model.sprites.values())
+    sprites += [sprite for column in model.sleeping.values() for sprite, tick in column.values()]
+    out = [(type(s).__name__, round(s.x, 6), round(s.y, 6), s.w, s.h) for s in sprites]
+    out += [(model.SPAWNS[kind][0].__name__, x, y, w, h)
+            for column in model.unloaded.values() for kind, x, y, w, h in column.values()]
+    for batch in model.all_batches() + model.dormant_batches():
+        for i in range(len(batch)):
+            out.append((NAMES[type(batch).__name__], round(float(batch.x[i]), 6),
+                        round(float(batch.y[i]), 6), int(batch.w[i]), int(batch.h[i])))
+    return sorted(out)
+
+
+def level_path(name, generated):
+    return "map.json" if name == "map.json" else str(generated / name)
+
+
+def run(map_file, backend="objects", sleep_margin=None, lazy=False, ticks=TICKS):
+    # Yields the model after every tick of the script, as Simulation.tick
+    # plays it
+    model = game.Model(map_file, backend, lazy)
+    model.sleep_margin = sleep_margin
+    model.catch_up = 5
+    controller = game.Controller(model, game.HeadlessView(model))
+    for keys in script(ticks):
+        controller.apply_input(keys)
+        controller.update()
+        model.update()
+        yield model
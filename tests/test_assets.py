@@ -0,0 +1,48 @@
+import os
+import shutil
+
+import pygame
+
+import game
+
+
+def pixels(surface):
+    return pygame.image.tostring(surface, "RGBA")
+
+
+def copy_images(tmp_path):
+    directory = str(tmp_path / "images")
+    os.mkdir(directory)
+    for name in os.listdir("images"):
+        if name.endswith(".png"):
+            shutil.copyfile("images/" + name, directory + "/" + name)
+    return directory
+
+
+def check_atlas(directory):
+    cache = game.AssetCache()
+    cache.load_atlas(directory)
+    names = [n for n in os.listdir(directory) if n.endswith(".png")]
+    assert cache.atlas_images == len(names)
+    for name in names:
+        path = directory + "/" + name
+        image = cache.load(path)
+        assert image.get_parent() is not None  # served from the sheet
+        assert pixels(image) == pixels(pygame.image.load(path)), name
+    return cache
+
+
+def test_atlas_images_match_their_files(tmp_path):
+    directory = copy_images(tmp_path)
+    check_atlas(directory)  # packs the sheet and writes it out
+    assert os.path.exists(directory + "/atlas.rgba")
+    check_atlas(directory)  # reads the written sheet back
+
+
+def test_atlas_is_rebuilt_when_an_image_changes(tmp_path):
+    directory = copy_images(tmp_path)
+    check_atlas(directory)
+    shutil.copyfile("images/goomba_fire.png", directory + "/goomba.png")
+    built = os.path.getmtime(directory + "/atlas.json")
+    os.utime(directory + "/goomba.png", (built + 1, built + 1))
+    check_atlas(directory)
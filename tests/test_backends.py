@@ -0,0 +1,46 @@
+import pytest
+
+import game
+from support import TICKS, level_path, run, script, snapshot
+
+
+@pytest.mark.parametrize("name", ["map.json", "generated.json", "generated.chunks"])
+@pytest.mark.parametrize("sleep_margin", [None, 300])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_backends_agree(name, sleep_margin, lazy, generated):
+    pytest.importorskip("numpy")
+    path = level_path(name, generated)
+    objects = run(path, "objects", sleep_margin, lazy)
+    numpy = run(path, "numpy", sleep_margin)
+    for tick, (a, b) in enumerate(zip(objects, numpy)):
+        assert snapshot(a) == snapshot(b), "backends differ at tick %d" % tick
+
+
+def test_backends_agree_with_editor_spawns():
+    # Spawns added while playing interleave the kinds in load order
+    pytest.importorskip("numpy")
+    edits = {}
+    for t in range(5, 300, 9):
+        x = 300 + t * 5
+        edits[t] = [("add", "drybones", x, 350, 40, 50), ("add", "goombas", x + 5, 375, 25, 25),
+                    ("add", "mushrooms", x + 50, 200, 20, 20)]
+        if t % 4 == 0:
+            edits[t].append(("remove", x - 40, 375))
+    objects = game.Simulation("map.json", script(TICKS), "objects", edits)
+    numpy = game.Simulation("map.json", script(TICKS), "numpy", edits)
+    for tick in range(TICKS):
+        objects.tick()
+        numpy.tick()
+        assert snapshot(objects.model) == snapshot(numpy.model), "backends differ at tick %d" % tick
+
+
+@pytest.mark.parametrize("name", ["map.json", "generated.json"])
+@pytest.mark.parametrize("sleep_margin", [None, 300])
+def test_lazy_load_plays_the_same(name, sleep_margin, generated):
+    path = level_path(name, generated)
+    eager = run(path, "objects", sleep_margin)
+    lazy = run(path, "objects", sleep_margin, lazy=True)
+    for tick, (a, b) in enumerate(zip(eager, lazy)):
+        assert a.state_hash() == b.state_hash(), "lazy load differs at tick %d" % tick
+        if tick % 50 == 0:
+            b.load_unloaded(0.0001)
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+import batch
+
+
+def test_runs_levels_and_reports_errors_per_run():
+    jobs = [{"map": "map.json", "ticks": 50}, {"map": "missing.json"}, {"map": "map.json", "ticks": 100}]
+    results = dict(batch.run(jobs, 2, timeout=60))
+    assert sorted(results) == [0, 1, 2]
+    assert results[0]["ticks"] == 50 and results[2]["ticks"] == 100
+    assert results[1]["error"].startswith("FileNotFoundError")
+
+
+def misbehave(job):
+    kind = job["kind"]
+    if kind == "exit0":
+        os._exit(0)
+    if kind == "exit3":
+        os._exit(3)
+    if kind == "sys.exit":
+        sys.exit(0)
+    if kind == "hang":
+        time.sleep(60)
+    return {"ran": kind}
+
+
+def test_dead_and_hung_workers_become_errors(monkeypatch):
+    # The workers only see the patched run_job when forked
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("needs the fork start method")
+    monkeypatch.setattr(batch, "run_job", misbehave)
+    kinds = ["ok", "exit0", "exit3", "sys.exit", "hang", "ok"]
+    start = time.perf_counter()
+    results = dict(batch.run([{"kind": kind} for kind in kinds], 3, timeout=2))
+    assert time.perf_counter() - start < 10
+    assert results == {
+        0: {"ran": "ok"},
+        1: {"error": "worker exited without a result"},
+        2: {"error": "worker exited with code 3"},
+        3: {"error": "SystemExit: 0"},
+        4: {"error": "timed out after 2s"},
+        5: {"ran": "ok"},
+    }
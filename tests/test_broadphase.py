@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import benchmark
+import game
+from support import run
+
+
+def collide_all_pairs(model, sprite):
+    # Model.collide without the broadphase: the sprite against every
+    # awake sprite and brick, in load order, as the loop before it did
+    wanted = game.COLLIDES_WITH[sprite.tag]
+    others = [s for s in list(model.sprites.values()) + list(model.tiles.bricks)
+              if s is not sprite and s.tag in wanted]
+    for other in sorted(others, key=lambda s: s.order):
+        model.pairs_tested += 1
+        if not (other.tag == game.TAG_BRICK or other in model.grid) or not sprite.collides_with(other):
+            continue
+        game.COLLISIONS[(sprite.tag, other.tag)](model, sprite, other)
+        model.collisions += 1
+        if sprite not in model.grid:
+            return
+        model.grid.move(sprite)
+
+
+def outcomes(path, ticks):
+    return [(model.state_hash(), model.collisions) for model in run(path, ticks=ticks)]
+
+
+@pytest.mark.parametrize("name", ["map.json", "small.json"])
+def test_broadphase_matches_all_pairs(name, tmp_path, monkeypatch):
+    path = name
+    if name == "small.json":
+        path = str(tmp_path / name)
+        with open(path, "w") as file:
+            json.dump(benchmark.generate_level(300, 40, 40, 10, seed=2), file)
+    grid = outcomes(path, 600)
+    monkeypatch.setattr(game.Model, "collide", collide_all_pairs)
+    assert outcomes(path, 600) == grid
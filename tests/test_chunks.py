@@ -0,0 +1,38 @@
+import game
+import levels
+from support import script
+
+import pytest
+
+
+@pytest.mark.parametrize("backend", ["objects", "numpy"])
+def test_eaten_spawns_stay_gone_when_their_chunk_reloads(backend, tmp_path):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    path = str(tmp_path / "one.chunks")
+    data = {"bricks": [{"x": x, "y": 450, "w": 50, "h": 50} for x in range(0, 6000, 50)],
+            "mushrooms": [{"x": 140, "y": 430, "w": 20, "h": 20}]}
+    levels.write_chunked(data, path)
+    sim = game.Simulation(path, [], backend)
+    for _ in range(25):
+        sim.tick(set())  # let the mushroom land
+    # Walk through the mushroom, far enough for its chunk to unload, then back
+    while sim.model.luigi.x < 3500:
+        sim.tick({"right"})
+    assert sim.model.luigi.h == 25
+    assert 0 not in sim.model.loaded_chunks
+    while sim.model.luigi.x > 1000:
+        sim.tick({"left"})
+    assert 0 in sim.model.loaded_chunks
+    assert sim.model.entity_count() == 1  # Luigi alone
+
+
+def test_chunked_level_plays_like_its_json(generated):
+    # Same level, same input: Luigi takes the same path through both
+    json_level = game.Simulation(str(generated / "generated.json"), script(1500), "objects")
+    chunked = game.Simulation(str(generated / "generated.chunks"), script(1500), "objects")
+    for tick in range(1500):
+        json_level.tick()
+        chunked.tick()
+        a, b = json_level.model.luigi, chunked.model.luigi
+        assert (a.x, a.y, a.h) == (b.x, b.y, b.h), "levels differ at tick %d" % tick
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+import game
+import inputlog
+from support import script
+
+
+@pytest.mark.parametrize("hashes", [True, False])
+def test_input_log_round_trip(hashes, tmp_path):
+    path = str(tmp_path / "session.log")
+    fires = {4: 3, 7: 2}
+    edits = {3: [("add", "goombas", 400, 375, 25, 25), ("remove", 420, 380)], 4: [("remove", 0, 0)]}
+    writer = inputlog.InputWriter(path, {"map": "map.json"}, hashes)
+    for tick, keys in enumerate(script(10)):
+        writer.write(keys | {"fire"} if tick in fires else keys, tick * 0x01010101, edits.get(tick, ()),
+                     fires.get(tick))
+    writer.close()
+    settings, inputs, read_hashes, read_edits, read_fires = inputlog.read(path)
+    assert settings == {"map": "map.json"}
+    assert inputs == [keys | {"fire"} if tick in fires else keys for tick, keys in enumerate(script(10))]
+    assert read_hashes == ([tick * 0x01010101 for tick in range(10)] if hashes else None)
+    assert read_edits == edits
+    assert read_fires == fires
+
+
+def test_reads_version_one_logs(tmp_path):
+    path = tmp_path / "old.log"
+    header = json.dumps({"map": "map.json", "hashes": True}).encode()
+    body = b"".join(inputlog.RECORD.pack(inputlog.encode(keys), tick) for tick, keys in enumerate(script(10)))
+    path.write_bytes(b"INPUTLOG1\n" + header + b"\n" + body)
+    settings, inputs, hashes, edits, fires = inputlog.read(str(path))
+    assert inputs == list(script(10))
+    assert hashes == list(range(10))
+    assert (edits, fires) == ({}, {})
+
+
+def test_replay_matches_the_recording(tmp_path):
+    # Several fireballs thrown in one tick replay as several, and the
+    # editor's changes land on the tick they were made
+    path = str(tmp_path / "session.log")
+    fires = {t: 1 + t % 3 for t in range(0, 400, 7)}
+    edits = {t: [("add", "goombas", 300 + t * 5, 375, 25, 25), ("remove", 200 + t * 5, 380)]
+             for t in range(10, 400, 30)}
+    sim = game.Simulation("map.json", script(400), edits=edits, fires=fires)
+    settings = {"map": "map.json", "backend": "objects",
+                "sleep_margin": sim.model.sleep_margin, "catch_up": sim.model.catch_up}
+    writer = inputlog.InputWriter(path, settings)
+    for keys in script(400):
+        sim.tick()
+        tick = sim.ticks - 1
+        writer.write(keys, sim.model.state_hash(), edits.get(tick, ()), fires.get(tick))
+    writer.close()
+    replayed, first_bad = game.replay(path, check=True)
+    assert first_bad is None
+    assert replayed.model.state_hash() == sim.model.state_hash()
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import game
+import levels
+from support import level_path, script
+
+
+@pytest.mark.parametrize("name", ["map.json", "generated.json"])
+def test_binary_level_round_trip(name, generated, tmp_path):
+    path = level_path(name, generated)
+    with open(path) as file:
+        data = json.load(file)
+    levels.write_binary(data, str(tmp_path / "level.bin"))
+    assert levels.is_binary(str(tmp_path / "level.bin"))
+    records = levels.read_binary(str(tmp_path / "level.bin"))
+    for kind in levels.KINDS:
+        assert levels.records_to_entries(kind, records[kind]) == data.get(kind, [])
+
+
+def test_binary_level_refuses_lossy_entries(tmp_path):
+    data = {"bricks": [{"x": 0.5, "y": 0, "w": 50, "h": 50}]}
+    with pytest.raises(ValueError):
+        levels.write_binary(data, str(tmp_path / "level.bin"))
+
+
+def test_binary_level_plays_like_its_json(generated, tmp_path):
+    with open(generated / "generated.json") as file:
+        levels.write_binary(json.load(file), str(tmp_path / "generated.bin"))
+    json_level = game.Simulation(str(generated / "generated.json"), script(600), "objects")
+    binary = game.Simulation(str(tmp_path / "generated.bin"), script(600), "objects")
+    for tick in range(600):
+        json_level.tick()
+        binary.tick()
+        assert json_level.model.state_hash() == binary.model.state_hash(), "levels differ at tick %d" % tick
+
+
+def copy_map(tmp_path):
+    path = str(tmp_path / "map.json")
+    shutil.copyfile("map.json", path)
+    with open(path) as file:
+        return path, json.load(file)
+
+
+EDITS = [
+    ("add", "bricks", levels.make_entry("bricks", 5000, 300, 50, 50)),
+    ("add", "goombas", levels.make_entry("goombas", 5100, 375, 25, 25)),
+    ("add", "goombas", levels.make_entry("goombas", 5100, 375, 25, 25)),  # already there
+    ("remove", "bricks", levels.make_entry("bricks", 5000, 300, 50, 50)),
+    ("add", "mushrooms", levels.make_entry("mushrooms", 5200, 200, 20, 20)),
+]
+
+
+def expected(data):
+    data = json.loads(json.dumps(data))
+    levels.apply_edits(data, [{"op": op, "kind": kind, "entry": entry} for op, kind, entry in EDITS])
+    return data
+
+
+@pytest.mark.parametrize("wait", [True, False])
+def test_edit_log_compaction(wait, tmp_path):
+    path, data = copy_map(tmp_path)
+    log = levels.EditLog(path)
+    for op, kind, entry in EDITS:
+        log.append(op, kind, entry)
+    assert log.compact(wait=wait)
+    log.close()
+    with open(path) as file:
+        level = json.load(file)
+    assert level == expected(data)
+    assert [levels.entry_box(e) for e in level["goombas"]].count((5100, 375, 25, 25)) == 1
+    assert not os.path.exists(path + levels.EDITS)
+    assert not os.path.exists(path + levels.COMPACTING)
+
+
+def test_edit_log_folds_what_a_crashed_session_left(tmp_path):
+    path, data = copy_map(tmp_path)
+    log = levels.EditLog(path)
+    for op, kind, entry in EDITS:
+        log.append(op, kind, entry)
+    log.file.close()  # the session dies before compacting
+    # Loading the level only reads it; the next editor folds the log in
+    game.Model(path)
+    with open(path) as file:
+        assert json.load(file) == data
+    levels.EditLog(path).close()
+    with open(path) as file:
+        assert json.load(file) == expected(data)
+    assert not os.path.exists(path + levels.EDITS)
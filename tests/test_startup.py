@@ -0,0 +1,9 @@
+import subprocess
+import sys
+
+
+def test_importing_game_opens_no_window():
+    # Tools like batch.py import game; only main() sets up the display
+    code = "import game, pygame; print(pygame.display.get_init(), pygame.display.get_surface())"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.splitlines()[-1] == "False None"
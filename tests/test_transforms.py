@@ -0,0 +1,53 @@
+import pygame
+import pytest
+
+import game
+
+
+@pytest.fixture
+def transforms(monkeypatch):
+    cache = game.TransformCache()
+    monkeypatch.setattr(game, "transforms", cache)
+    return cache
+
+
+def pixels(surface, area=None):
+    if area is not None:
+        surface = surface.subsurface(area)
+    return pygame.image.tostring(surface, "RGBA")
+
+
+def test_region_holds_the_scaled_and_flipped_image(transforms):
+    image = game.assets.load("images/drybones1.png")
+    for flip in (False, True):
+        expected = pygame.transform.scale(image, (40, 50))
+        if flip:
+            expected = pygame.transform.flip(expected, True, False)
+        sheet, area = transforms.region(image, 40, 50, flip)
+        assert pixels(sheet, area) == pixels(expected)
+
+
+def test_evicts_the_least_recently_used_sheet():
+    # Every image fills a sheet of its own
+    cache = game.TransformCache(sheet_size=64, max_sheets=2)
+    a, b, c = (pygame.Surface((8, 8)) for _ in range(3))
+    sheet_a, _ = cache.region(a, 64, 64)
+    sheet_b, _ = cache.region(b, 64, 64)
+    assert sheet_b is not sheet_a
+    cache.region(a, 64, 64)  # a's sheet is now the most recently used
+    cache.region(c, 64, 64)  # a third sheet pushes out b's
+    assert cache.evictions == 1
+    hits, misses = cache.hits, cache.misses
+    assert cache.region(a, 64, 64)[0] is sheet_a
+    assert cache.hits == hits + 1
+    cache.region(b, 64, 64)
+    assert cache.misses == misses + 1
+
+
+def test_luigi_resizing_misses_once_per_size(transforms):
+    luigi = game.Luigi(100, 50, 25, 50, "images/luigi1.png")
+    luigi.blit_args(0)
+    for _ in range(4):
+        luigi.eat_mushroom()  # 50 -> 25 -> 50 px tall and so on
+        luigi.blit_args(0)
+    assert (transforms.misses, transforms.hits) == (2, 3)
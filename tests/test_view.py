@@ -0,0 +1,89 @@
+import pygame
+import pytest
+
+import game
+from support import script
+
+
+@pytest.fixture
+def display():
+    yield pygame.display.set_mode((1000, 500))
+    pygame.display.quit()
+
+
+@pytest.fixture
+def views(display):
+    # One layered and one immediate View over the same model and display
+    def make(map_file, backend):
+        model = game.Model(map_file, backend)
+        pair = [game.View(model, True), game.View(model, False)]
+        for view in pair:
+            view.set_edit_info(False, True, False, "brick")
+        return model, pair
+    yield make
+    pygame.display.quit()
+
+
+def frame(view, alpha=1.0):
+    view.update(alpha)
+    return pygame.image.tostring(view.canvas, "RGB")
+
+
+@pytest.mark.parametrize("backend", ["objects", "numpy"])
+def test_layered_frames_match_immediate_at_fractional_scrolls(views, backend):
+    model, (layered, immediate) = views("map.json", backend)
+    for scroll_x in (0, 4.5, 4.25, 17.75, 100.5, 123.999, 250.5, 333.3):
+        for view in (layered, immediate):
+            view.set_scroll_x(scroll_x)
+        layered.last_scroll_x = None  # redraw the whole background
+        assert frame(layered) == frame(immediate), scroll_x
+        assert (layered.drawn, layered.culled) == (immediate.drawn, immediate.culled)
+
+
+@pytest.mark.parametrize("backend", ["objects", "numpy"])
+def test_layered_frames_match_immediate_between_ticks(views, backend):
+    model, (layered, immediate) = views("map.json", backend)
+    controller = game.Controller(model, game.HeadlessView(model))
+    for t, keys in enumerate(script(300)):
+        for view in (layered, immediate):
+            view.remember()
+        controller.apply_input(keys)
+        controller.update()
+        model.update()
+        for view in (layered, immediate):
+            view.set_scroll_x(controller.view.scroll_x)
+        if t % 10 == 0:
+            for alpha in (0.25, 0.5, 1.0):
+                # Layered draws keep last frame's background where nothing moved
+                assert frame(layered, alpha) == frame(immediate, alpha), (t, alpha)
+
+
+def interpolated_frames(backend, alphas):
+    # The screen rect of everything drawn at each alpha between every two
+    # ticks of the script, checking Luigi's against where he was and is
+    model = game.Model("map.json", backend)
+    view = game.View(model, False)
+    controller = game.Controller(model, view)
+    luigi = model.luigi
+    for keys in script(300):
+        view.remember()
+        before = (luigi.x, luigi.y, view.scroll_x)
+        controller.apply_input(keys)
+        controller.update()
+        model.update()
+        for alpha in alphas:
+            view.update(alpha)
+            x, y, scroll_x = (a + (b - a) * alpha for a, b in zip(before, (luigi.x, luigi.y, view.scroll_x)))
+            assert view.draw_x == pytest.approx(scroll_x)
+            rects = view.draw_sprites(model.sprites_in(view.draw_x, 0, 1000, 500))
+            assert pygame.Rect(int(x - view.draw_x) - 1, int(y) - 1, luigi.w + 2, luigi.h + 2) in rects
+            yield sorted(map(tuple, rects))
+
+
+def test_update_draws_between_the_last_two_ticks(display):
+    pytest.importorskip("numpy")
+    alphas = (0.0, 0.25, 0.5, 1.0)
+    objects = interpolated_frames("objects", alphas)
+    numpy = interpolated_frames("numpy", alphas)
+    for frame, (a, b) in enumerate(zip(objects, numpy)):
+        assert a == b, "backends draw differently at tick %d, alpha %g" % divmod(frame, len(alphas))